@@ -0,0 +1,122 @@
+"""
+Compare the table models on construction, sorting and scrolling.
+
+    python benchmarks/table_models.py [rows] [columns]
+
+Needs Qt, runs offscreen.
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import pandas as pd
+from AnyQt import QtCore
+from AnyQt.QtWidgets import QApplication
+
+from orangecontrib.etsy.widgets.lib.table_helpers import DataFrameModel, DataFrameSortFilterProxyModel
+from orangecontrib.etsy.widgets.lib.tabletest import PandasModel
+
+VISIBLE_ROWS = 40
+SCROLLED_ROWS = 10000
+
+
+class CopyingPandasModel(QtCore.QAbstractTableModel):
+    # The model table_helpers used to have, data() reads by position so it can run at all
+    def __init__(self, df):
+        super().__init__()
+        self._df = df.copy()
+
+    def rowCount(self, parent=None):
+        return len(self._df.index)
+
+    def columnCount(self, parent=None):
+        return len(self._df.columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        return str(self._df.iloc[index.row(), index.column()])
+
+    def sort(self, column, order):
+        self.layoutAboutToBeChanged.emit()
+        self._df.sort_values(self._df.columns[column], ascending=order == QtCore.Qt.AscendingOrder, inplace=True)
+        self._df.reset_index(inplace=True, drop=True)
+        self.layoutChanged.emit()
+
+
+def make_data_frame(rows, columns):
+    rng = np.random.default_rng(0)
+    data = {}
+    for i in range(columns):
+        if i % 3 == 0:
+            data[f"num_{i}"] = rng.random(rows)
+        elif i % 3 == 1:
+            data[f"int_{i}"] = rng.integers(0, 10 ** 9, rows)
+        else:
+            data[f"str_{i}"] = rng.choice(["red", "green", "blue", "purple", None], rows)
+    return pd.DataFrame(data)
+
+
+def make_data_frame_model(df):
+    model = DataFrameModel()
+    model.setDataFrame(df)
+    return model
+
+
+def make_proxy_model(df):
+    model = DataFrameSortFilterProxyModel()
+    model.setSourceModel(make_data_frame_model(df))
+    return model
+
+
+def scroll(model):
+    # Read every cell of each screenful, like a view scrolled to the bottom of the first rows
+    columns = model.columnCount()
+    row = 0
+    while row < SCROLLED_ROWS:
+        if row + VISIBLE_ROWS > model.rowCount() and hasattr(model, "canFetchMore") and model.canFetchMore(QtCore.QModelIndex()):
+            model.fetchMore(QtCore.QModelIndex())
+        last = min(row + VISIBLE_ROWS, model.rowCount())
+        if last <= row:
+            break
+        for r in range(row, last):
+            for c in range(columns):
+                model.data(model.index(r, c), QtCore.Qt.DisplayRole)
+        row = last
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception as ex:  # the older models do not all work with current pandas
+        return None, f"{type(ex).__name__}"
+    return result, f"{(time.perf_counter() - start) * 1000:9.1f} ms"
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    app = QApplication.instance() or QApplication([])
+    df = make_data_frame(rows, columns)
+    print(f"{rows} rows, {columns} columns")
+    print(f"{'model':<32}{'construct':>14}{'sort':>14}{'scroll':>14}")
+    for name, factory in (
+            ("PandasModel", PandasModel),
+            ("PandasModel (copying, old)", CopyingPandasModel),
+            ("DataFrameModel", make_data_frame_model),
+            ("DataFrameSortFilterProxyModel", make_proxy_model)):
+        model, construct = timed(factory, df)
+        if model is None:
+            print(f"{name:<32}{construct:>14}")
+            continue
+        # Sort on a string column, the slowest kind
+        _, sort = timed(model.sort, 2, QtCore.Qt.DescendingOrder)
+        _, scrolled = timed(scroll, model)
+        print(f"{name:<32}{construct:>14}{sort:>14}{scrolled:>14}")
+    del app
+
+
+if __name__ == "__main__":
+    main()
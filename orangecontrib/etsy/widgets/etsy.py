@@ -10,6 +10,7 @@ import textwrap
 import threading
 import traceback
 from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import partial
 
@@ -24,6 +25,7 @@ from AnyQt.QtWidgets import QTableView, QLineEdit
 from Orange.data import (
 	Table, )
 from Orange.widgets import gui
+from Orange.widgets.utils.concurrent import ConcurrentWidgetMixin, FutureWatcher
 from Orange.widgets.settings import (
 	Setting, ContextSetting
 )
@@ -33,26 +35,29 @@ from Orange.widgets.widget import OWWidget, Output, Msg
 from AnyQt import QtWidgets
 from PyQt5.QtCore import QEventLoop
 from PyQt5.QtWidgets import QTreeView, QInputDialog, QMessageBox, QSlider, QDoubleSpinBox, QComboBox, QAbstractItemView, \
-	QCheckBox, QSpinBox, QLabel, QSpacerItem
+	QCheckBox, QSpinBox, QLabel, QSpacerItem, QPushButton
 from superqt import QLabeledRangeSlider
 from urllib3.exceptions import InsecureRequestWarning
 
 # from qtrangeslider import QLabeledRangeSlider
 
+from orangecontrib.etsy.widgets.lib.cache_helpers import etsy_cache_dir
 from orangecontrib.etsy.widgets.lib.etsy_api_client import EtsyOAuth2Client
-from orangecontrib.etsy.widgets.lib.qjsonmodel import QJsonModel
+from orangecontrib.etsy.widgets.lib.qjsonmodel import QJsonModel, QJsonTreeItem
+from orangecontrib.etsy.widgets.lib.route_table import BoundRoute
 from orangecontrib.etsy.widgets.lib.searchbar_helpers import SearchBarComboBox
+from orangecontrib.etsy.widgets.lib.taxonomy_store import TaxonomyStore
 from orangecontrib.etsy.widgets.lib.table_helpers import (
 	CreateTableContextHandler,
-	EditableTableItemDelegate, EditableTableModel, PandasModel)
+	EditableTableItemDelegate, EditableTableModel)
 from orangecontrib.etsy.widgets.lib.tabletest import PandasModel
 from orangecontrib.etsy.widgets.lib.widgets_helper import WidgetsHelper, ElementTreeWidget, SetupHelper
-from orangecontrib.etsy.widgets.lib.request_helper import RequestHelper
+from orangecontrib.etsy.widgets.lib.request_helper import RequestHelper, TransformOptions, TransformResult, TransformStages
 
 from linq import Query
 
 
-class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper):
+class OrangeEtsyApiInterface(OWWidget, ConcurrentWidgetMixin, SetupHelper, WidgetsHelper, RequestHelper):
 	name = "Etsy API"
 	description = "Orange widget for using the Etsy API and its data."
 	icon = "icons/etsy_icon_round.svg"
@@ -84,6 +89,8 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 	ETSY_API_TOKEN = None
 	ETSY_AUTO_CLOSE_BROWSER = True
 	ETSY_AUTO_REFRESH_TOKEN = True
+	# Seconds before it expires the access token is refreshed
+	ETSY_TOKEN_REFRESH_SKEW = 5 * 60
 	ETSY_AUTO_START_AUTH = False
 	ETSY_VERBOSE = False
 	ETSY_HOST = "localhost"
@@ -110,8 +117,15 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 	FLATTEN_TABLE = False
 	SEQUENCE_REQUESTS = False
 
+	FETCH_ALL_PAGES = False
+
+	STREAM_RESULTS = False
+	STREAM_EMIT_ROWS = 1000
+	STREAM_EMIT_SECONDS = 2.0
+
 
 	ETSY_API_RESPONSE = {}
+	ETSY_API_RESPONSE_OPERATION_ID = None
 
 	ETSY_API_RESPONSE_DF = None
 	ETSY_API_RESPONSE_DF_MODEL = None
@@ -121,6 +135,9 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 
 	DISPLAY_FLATTENED_TABLE = False
 	REMOVE_ORIGINAL_COLUMN = False
+	SPARSE_OUTPUT = True
+	SPARSE_DENSITY_THRESHOLD = 0.1
+	NESTED_DEPTH = 1
 
 	selected_methods = {
 		"GET": True,
@@ -152,6 +169,13 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 
 	CLIENT_MAX_THREADS = 8
 
+	ASYNC_REQUESTS = False
+
+	CLIENT_RATE_LIMIT = 10
+	CLIENT_RATE_BURST = 10
+
+	CACHE_RESPONSES = True
+
 	LOG_TO_FILE = False
 
 
@@ -161,6 +185,7 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 
 	def __init__(self):
 		super().__init__()
+		ConcurrentWidgetMixin.__init__(self)
 		requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 		self.ETSY_API_CLIENT = EtsyOAuth2Client(
 			api_token=self.ETSY_API_TOKEN,
@@ -170,13 +195,28 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 			verbose=self.ETSY_VERBOSE,
 			host=self.ETSY_HOST,
 			port=self.ETSY_PORT,
-			reference_file_path=self.ETSSY_API_REFERENCE_FILE_PATH
+			reference_file_path=self.ETSSY_API_REFERENCE_FILE_PATH,
+			rate_limit=self.CLIENT_RATE_LIMIT,
+			rate_burst=self.CLIENT_RATE_BURST,
+			pool_size=self.CLIENT_MAX_THREADS,
+			cache_responses=self.CACHE_RESPONSES,
+			token_refresh_skew=self.ETSY_TOKEN_REFRESH_SKEW
 		)
 		# self.ETSY_API_CLIENT.session = requests.Session()
 		# self.ETSY_API_CLIENT.session = aiohttp.ClientSession()
 
 		# asyncio.set_event_loop(qasync.QEventLoop(self))
-		self.loop = qasync.QEventLoop(self)
+		# The qasync loop is only created once the asyncio engine is first used
+		self.loop = None
+		self.async_request = None
+		# Read from disk on first use, refreshed in the background after authenticating
+		self.taxonomy_store = TaxonomyStore(os.path.join(etsy_cache_dir(), "buyer_taxonomy.pickle"))
+		self.taxonomy_executor = ThreadPoolExecutor(max_workers=1)
+		self.taxonomy_watcher = None
+		# The response the tree view was last built from
+		self.tree_response = None
+		self.transform_stages = TransformStages()
+		self.sent_table = None
 		WidgetsHelper.__init__(self)
 		RequestHelper.__init__(self)
 		self.setup_ui()
@@ -224,33 +264,112 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 		if not self.ETSY_API_RESPONSE:
 			QMessageBox.warning(self, "Warning", "No data available. Please send a request first.")
 			return
+		self.start(self.transform_task, self.ETSY_API_RESPONSE,
+		           self.transform_options(self.ETSY_API_RESPONSE_OPERATION_ID))
+
+	def transform_options(self, operation_id=None):
+		if operation_id is None and isinstance(self.etsy_client_send_request, BoundRoute):
+			operation_id = self.etsy_client_send_request.route.operation_id
+		return TransformOptions(
+			flatten=self.FLATTEN_TABLE,
+			remove_original_columns=self.REMOVE_ORIGINAL_COLUMN,
+			sparse_threshold=self.SPARSE_DENSITY_THRESHOLD if self.SPARSE_OUTPUT else 0.0,
+			operation_id=operation_id,
+			nested_depth=self.NESTED_DEPTH)
+
+	def transform_task(self, response, options, state, fetched=False):
+		# Runs on the worker thread, so nothing in here may touch a widget
+		state.set_status("Transforming data")
+		stages = self.transform_stages.for_response(response)
+		warnings = []
+
+		df_json = stages.get("frame", None, lambda: pd.DataFrame(response["results"]))
+		df = df_json
+		df_flattened = None
+
+		if options.flatten:
+			def flatten():
+				flatten_warnings = []
+				return self.flatten_frame(df_json, options, flatten_warnings), flatten_warnings
+			# Every option goes into flattening, the flatten flag itself is always set here
+			df_flattened, flatten_warnings = stages.get("flattened", options, flatten)
+			warnings.extend(flatten_warnings)
+			df = df_flattened
+
+		if df_flattened is None:
+			table = stages.get("table", (False, options.operation_id),
+			                   lambda: self.records_to_orange(response["results"], options.operation_id))
+		else:
+			table = stages.get("table", options,
+			                   lambda: self.pandas_to_orange(df_flattened, options.operation_id, options.nested_depth))
+		return TransformResult(response, df_json, df_flattened, df, table, warnings, fetched,
+		                       options.operation_id, stages)
+
+	def on_done(self, result):
+		if result is None:
+			return
+		self.set_request_running(False)
+		self.ETSY_API_RESPONSE = result.response
+		self.ETSY_API_RESPONSE_OPERATION_ID = result.operation_id
+		if result.fetched:
+			self.change_http_status_label("200 OK", color="green")
+			self.report_rate_limiter_stats()
+			self.report_transport_stats()
+			self.report_cache_stats()
+
 		# if True: # self.df is not None:
 		# show the button again
 		self.refresh_data_button.show()
 
 		self.enable_qgroupbox_and_color_title(self.flattenOptionsControlBox)
 
-		# Populate tree view
-		self.tree_model = QJsonModel()
-		self.treeWidget.setModel(self.tree_model)
-		self.tree_model.load(self.ETSY_API_RESPONSE)
+		# Only rebuilt if the tree tab is showing and the response is a new one
+		self.update_tree_view()
 
-		self.df_json = pd.DataFrame(self.ETSY_API_RESPONSE["results"])
-		self.df = self.df_json
+		self.df_json, self.df_flattened, self.df = result.df_json, result.df_flattened, result.df
+		self.transform_stages = result.stages
 
-		if self.FLATTEN_TABLE:
-			self.df_flattened = self.binarize_columns(self.df, self.REMOVE_ORIGINAL_COLUMN)
-			self.df = self.df_flattened
+		self.update_table_view()
 
-		# Set table data
-		model = PandasModel(self.df_flattened if self.DISPLAY_FLATTENED_TABLE
-							else self.df_json)
-		self.tableWidget.setModel(model)
+		# An empty message clears the warnings of the previous run
+		self.warning("\n".join(result.warnings))
+		if result.warnings:
+			QMessageBox.warning(self, "Warning", "\n".join(result.warnings), QMessageBox.Ok)
 
+		# Unchanged stages hand back the table that was sent already
+		if result.table is not self.sent_table:
+			self.sent_table = result.table
+			self.Outputs.data.send(result.table)
 
-		# Set output data
-		table = self.pandas_to_orange(self.df)
-		self.Outputs.data.send(table)
+	def on_partial_result(self, result):
+		if result.table is None:
+			return
+		self.sent_table = result.table
+		self.Outputs.data.send(result.table)
+		self.change_app_status_label(
+			f"Streaming: {result.rows} rows, {result.pages_done}/{result.pages_total} pages", color="orange")
+
+	def on_exception(self, ex):
+		self.set_request_running(False)
+		self.handle_etsy_api_client_exception(ex)
+
+	def update_table_view(self):
+		df = self.df_flattened if self.DISPLAY_FLATTENED_TABLE and self.df_flattened is not None else self.df_json
+		if df is None:
+			return
+		model = self.tableWidget.model()
+		if isinstance(model, PandasModel) and model.df is df:
+			return
+		self.tableWidget.setModel(PandasModel(df))
+
+	def update_tree_view(self):
+		# The tree is built the first time the tree tab is shown for a response, flattening
+		# options don't change the json so transforming it again keeps the tree as it is
+		response = self.ETSY_API_RESPONSE
+		if not response or self.tree_response is response or self.tabWidget.currentWidget() is not self.treeTab:
+			return
+		self.tree_response = response
+		self.tree_model.setRootItem(QJsonTreeItem.load(response))
 
 	def populate_search_box(self):
 		self.ETSY_ROUTES = list(self.ETSY_API_CLIENT.get_api_routes())
@@ -430,6 +549,20 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 					lambda: setattr(self, "ETSY_AUTO_REFRESH_TOKEN", self.check_ETSY_AUTO_REFRESH_TOKEN.isChecked()))
 				self.etsy_options_tree.add_element(self.check_ETSY_AUTO_REFRESH_TOKEN)
 
+				def update_token_refresh_skew(value):
+					self.ETSY_TOKEN_REFRESH_SKEW = value
+					self.ETSY_API_CLIENT.token_refresh_skew = value
+
+				self.check_ETSY_TOKEN_REFRESH_SKEW = QSpinBox()
+				self.check_ETSY_TOKEN_REFRESH_SKEW.setRange(0, 30 * 60)
+				self.check_ETSY_TOKEN_REFRESH_SKEW.setSingleStep(30)
+				self.check_ETSY_TOKEN_REFRESH_SKEW.setValue(self.ETSY_TOKEN_REFRESH_SKEW)
+				self.check_ETSY_TOKEN_REFRESH_SKEW.setToolTip(
+					"Refresh the access token this many seconds before it expires, so long pulls don't run into it")
+				self.check_ETSY_TOKEN_REFRESH_SKEW.valueChanged.connect(update_token_refresh_skew)
+				self.etsy_options_tree.add_element(
+					self.build_element_with_label("Refresh token early (s)", self.check_ETSY_TOKEN_REFRESH_SKEW))
+
 				# self.check_ETSY_AUTO_START_AUTH = QCheckBox("Auto start auth")
 				# self.check_ETSY_AUTO_START_AUTH.setChecked(self.ETSY_AUTO_START_AUTH)
 				# # self.check_ETSY_AUTO_START_AUTH.stateChanged.connect(self.on_check_ETSY_AUTO_START_AUTH_stateChanged)
@@ -475,14 +608,67 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 
 				# self.etsyOptionsControlBox.setFlat(False)
 
+				def update_max_threads():
+					self.CLIENT_MAX_THREADS = self.check_CLIENT_MAX_THREADS.value()
+					# One pooled connection per worker thread
+					self.ETSY_API_CLIENT.transport.resize(self.CLIENT_MAX_THREADS)
+					self.ETSY_API_CLIENT.async_engine.resize(self.CLIENT_MAX_THREADS)
+
 				self.check_CLIENT_MAX_THREADS = QSpinBox()
+				self.check_CLIENT_MAX_THREADS.setMinimum(1)
 				self.check_CLIENT_MAX_THREADS.setValue(self.CLIENT_MAX_THREADS)
-				self.check_ETSY_PORT.valueChanged.connect(
-					lambda: setattr(self, "CLIENT_MAX_THREADS", self.check_CLIENT_MAX_THREADS.value()))
+				self.check_CLIENT_MAX_THREADS.valueChanged.connect(update_max_threads)
 
 				self.etsy_options_tree.add_element(
 					self.build_element_with_label("Max threads", self.check_CLIENT_MAX_THREADS))
 
+				self.check_ASYNC_REQUESTS = QCheckBox("Use asyncio engine")
+				self.check_ASYNC_REQUESTS.setChecked(self.ASYNC_REQUESTS)
+				self.check_ASYNC_REQUESTS.setToolTip(
+					"Fetch pages with aiohttp on the Qt event loop instead of a thread per page")
+				self.check_ASYNC_REQUESTS.stateChanged.connect(
+					lambda: setattr(self, "ASYNC_REQUESTS", self.check_ASYNC_REQUESTS.isChecked()))
+				self.etsy_options_tree.add_element(self.check_ASYNC_REQUESTS)
+
+				def update_rate_limiter():
+					self.CLIENT_RATE_LIMIT = self.check_CLIENT_RATE_LIMIT.value()
+					self.CLIENT_RATE_BURST = self.check_CLIENT_RATE_BURST.value()
+					self.ETSY_API_CLIENT.rate_limiter.configure(
+						rate=self.CLIENT_RATE_LIMIT, burst=self.CLIENT_RATE_BURST)
+
+				self.check_CLIENT_RATE_LIMIT = QSpinBox()
+				self.check_CLIENT_RATE_LIMIT.setRange(1, 1000)
+				self.check_CLIENT_RATE_LIMIT.setValue(self.CLIENT_RATE_LIMIT)
+				self.check_CLIENT_RATE_LIMIT.valueChanged.connect(update_rate_limiter)
+				self.etsy_options_tree.add_element(
+					self.build_element_with_label("Requests/sec", self.check_CLIENT_RATE_LIMIT))
+
+				self.check_CLIENT_RATE_BURST = QSpinBox()
+				self.check_CLIENT_RATE_BURST.setRange(1, 1000)
+				self.check_CLIENT_RATE_BURST.setValue(self.CLIENT_RATE_BURST)
+				self.check_CLIENT_RATE_BURST.valueChanged.connect(update_rate_limiter)
+				self.etsy_options_tree.add_element(
+					self.build_element_with_label("Burst", self.check_CLIENT_RATE_BURST))
+
+				def check_CACHE_RESPONSES_callback():
+					self.CACHE_RESPONSES = self.check_CACHE_RESPONSES.isChecked()
+					self.ETSY_API_CLIENT.response_cache.enabled = self.CACHE_RESPONSES
+
+				self.check_CACHE_RESPONSES = QCheckBox("Cache GET responses")
+				self.check_CACHE_RESPONSES.setChecked(self.CACHE_RESPONSES)
+				self.check_CACHE_RESPONSES.setToolTip(
+					"Serve repeated GET requests from disk until their time to live expires")
+				self.check_CACHE_RESPONSES.stateChanged.connect(check_CACHE_RESPONSES_callback)
+				self.etsy_options_tree.add_element(self.check_CACHE_RESPONSES)
+
+				def clear_response_cache():
+					self.ETSY_API_CLIENT.response_cache.clear()
+					self.change_cache_label("cleared")
+
+				self.clearCacheButton = QPushButton("Clear response cache")
+				self.clearCacheButton.clicked.connect(clear_response_cache)
+				self.etsy_options_tree.add_element(self.clearCacheButton)
+
 				self.check_ETSY_HOST.setAlignment(Qt.AlignTop)
 
 				#### HTTP OPTIONS
@@ -597,7 +783,8 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 				self.check_DISPLAY_FLATTENED_TABLE.setChecked(self.DISPLAY_FLATTENED_TABLE)
 				def check_DISPLAY_FLATTENED_TABLE_callback(element,):
 					self.DISPLAY_FLATTENED_TABLE = self.check_DISPLAY_FLATTENED_TABLE.isChecked()
-					self.populate_data()
+					# Only changes which frame the table shows
+					self.update_table_view()
 				# self.check_DISPLAY_FLATTENED_TABLE.stateChanged.connect(self.populate_data)
 				self.check_DISPLAY_FLATTENED_TABLE.stateChanged.connect(check_DISPLAY_FLATTENED_TABLE_callback)
 				self.flattenTableTreeMenu.add_element(self.check_DISPLAY_FLATTENED_TABLE)
@@ -611,6 +798,41 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 				self.check_REMOVE_ORIGINAL_COLUMN.stateChanged.connect(check_REMOVE_ORIGINAL_COLUMN_callback)
 				self.flattenTableTreeMenu.add_element(self.check_REMOVE_ORIGINAL_COLUMN)
 
+				self.check_NESTED_DEPTH = QSpinBox()
+				self.check_NESTED_DEPTH.setRange(0, 5)
+				self.check_NESTED_DEPTH.setValue(self.NESTED_DEPTH)
+				self.check_NESTED_DEPTH.setToolTip(
+					"Expand nested objects (price, shipping_profile, ...) into dotted columns up to this depth")
+				def check_NESTED_DEPTH_callback(value):
+					self.NESTED_DEPTH = value
+					self.populate_data()
+				self.check_NESTED_DEPTH.valueChanged.connect(check_NESTED_DEPTH_callback)
+				self.flattenTableTreeMenu.add_element(
+					self.build_element_with_label("Nested depth", self.check_NESTED_DEPTH))
+
+				self.check_SPARSE_OUTPUT = QCheckBox("Sparse indicator columns")
+				self.check_SPARSE_OUTPUT.setChecked(self.SPARSE_OUTPUT)
+				self.check_SPARSE_OUTPUT.setToolTip(
+					"Send mostly-zero indicator columns as a sparse table instead of a dense matrix")
+				def check_SPARSE_OUTPUT_callback():
+					self.SPARSE_OUTPUT = self.check_SPARSE_OUTPUT.isChecked()
+					self.check_SPARSE_DENSITY_THRESHOLD.setEnabled(self.SPARSE_OUTPUT)
+					self.populate_data()
+				self.check_SPARSE_OUTPUT.stateChanged.connect(check_SPARSE_OUTPUT_callback)
+				self.flattenTableTreeMenu.add_element(self.check_SPARSE_OUTPUT)
+
+				self.check_SPARSE_DENSITY_THRESHOLD = QDoubleSpinBox()
+				self.check_SPARSE_DENSITY_THRESHOLD.setRange(0.0, 1.0)
+				self.check_SPARSE_DENSITY_THRESHOLD.setSingleStep(0.05)
+				self.check_SPARSE_DENSITY_THRESHOLD.setValue(self.SPARSE_DENSITY_THRESHOLD)
+				self.check_SPARSE_DENSITY_THRESHOLD.setEnabled(self.SPARSE_OUTPUT)
+				def check_SPARSE_DENSITY_THRESHOLD_callback(value):
+					self.SPARSE_DENSITY_THRESHOLD = value
+					self.populate_data()
+				self.check_SPARSE_DENSITY_THRESHOLD.valueChanged.connect(check_SPARSE_DENSITY_THRESHOLD_callback)
+				self.flattenTableTreeMenu.add_element(
+					self.build_element_with_label("Max density", self.check_SPARSE_DENSITY_THRESHOLD))
+
 				# self.flatten_table_tree = self.build_elements_tree(QCheckBox("Flatten table"), flatten_buttons)
 				self.flattenOptionsControlBox.layout().addWidget(self.flattenTableTreeMenu)
 
@@ -664,11 +886,55 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 				self.paginateTreeMenu.add_element(QLabel(""))
 
 				self.paginateTreeMenu.add_element(self.paginateSlider)
+
+				# Instead of the slider range, read the total from the first page and
+				# only request the pages that actually exist
+				self.check_FETCH_ALL_PAGES = QCheckBox("Fetch all (use response count)")
+				self.check_FETCH_ALL_PAGES.setChecked(self.FETCH_ALL_PAGES)
+				self.check_FETCH_ALL_PAGES.setEnabled(False)
+
+				def check_FETCH_ALL_PAGES_callback():
+					self.FETCH_ALL_PAGES = self.check_FETCH_ALL_PAGES.isChecked()
+					self.paginateSlider.setEnabled(
+						self.check_SEQUENCE_REQUESTS.isChecked() and not self.FETCH_ALL_PAGES)
+
+				self.check_FETCH_ALL_PAGES.stateChanged.connect(check_FETCH_ALL_PAGES_callback)
+				self.paginateTreeMenu.add_element(self.check_FETCH_ALL_PAGES)
+
 				self.paginateOptionsControlBox.layout().addWidget(self.paginateTreeMenu)
 
+				# Streaming sends partial tables while later pages are still in flight
+				self.streamTreeMenu = ElementTreeWidget()
+				self.check_STREAM_RESULTS = QCheckBox("Stream partial results")
+				self.check_STREAM_RESULTS.setChecked(self.STREAM_RESULTS)
+				self.check_STREAM_RESULTS.stateChanged.connect(
+					lambda: setattr(self, "STREAM_RESULTS", self.check_STREAM_RESULTS.isChecked()))
+				self.streamTreeMenu.set_top_level_element(self.check_STREAM_RESULTS)
+
+				self.check_STREAM_EMIT_ROWS = QSpinBox()
+				self.check_STREAM_EMIT_ROWS.setRange(1, 1000000)
+				self.check_STREAM_EMIT_ROWS.setValue(self.STREAM_EMIT_ROWS)
+				self.check_STREAM_EMIT_ROWS.valueChanged.connect(
+					lambda: setattr(self, "STREAM_EMIT_ROWS", self.check_STREAM_EMIT_ROWS.value()))
+				self.streamTreeMenu.add_element(
+					self.build_element_with_label("Emit every N rows", self.check_STREAM_EMIT_ROWS))
+
+				self.check_STREAM_EMIT_SECONDS = QDoubleSpinBox()
+				self.check_STREAM_EMIT_SECONDS.setRange(0.1, 3600)
+				self.check_STREAM_EMIT_SECONDS.setValue(self.STREAM_EMIT_SECONDS)
+				self.check_STREAM_EMIT_SECONDS.valueChanged.connect(
+					lambda: setattr(self, "STREAM_EMIT_SECONDS", self.check_STREAM_EMIT_SECONDS.value()))
+				self.streamTreeMenu.add_element(
+					self.build_element_with_label("Emit every T seconds", self.check_STREAM_EMIT_SECONDS))
+
+				self.paginateOptionsControlBox.layout().addWidget(self.streamTreeMenu)
+
 				def check_SEQUENCE_REQUESTS_callback(data, widget):
 					self.toggle_elements_enabled(
-						[text_label, self.paginateSlider, self.paginateLimitSpinner, self.paginateLimitLabel])
+						[text_label, self.paginateSlider, self.paginateLimitSpinner, self.paginateLimitLabel,
+						 self.check_FETCH_ALL_PAGES])
+					if self.FETCH_ALL_PAGES:
+						self.paginateSlider.setEnabled(False)
 					if self.check_SEQUENCE_REQUESTS.isChecked():
 						if self.offset_element:
 							self.offset_element.setEnabled(False)
@@ -677,6 +943,7 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 						self.paginateLimitValue = self.paginateLimitSpinner.value()
 
 					else:
+						self.check_FETCH_ALL_PAGES.setChecked(False)
 						if self.offset_element:
 							self.offset_element.setEnabled(True)
 						if self.limit_element:
@@ -733,6 +1000,7 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 					nonlocal self
 					self.ETSY_API_RESPONSE = json.loads(
 						open(os.path.expanduser("~/debug_response.json"), encoding="utf8").read(), strict=False)
+					self.ETSY_API_RESPONSE_OPERATION_ID = None
 					self.change_http_status_label("-100 DEBUGGING", color="orange")
 					self.populate_data()
 
@@ -745,6 +1013,9 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 				self.sendRequestButton = gui.button(self.buttonsArea, self, "Please authenticate")
 				self.sendRequestButton.setEnabled(False)
 
+				self.cancelRequestButton = gui.button(self.buttonsArea, self, "Cancel", callback=self.cancel_request)
+				self.cancelRequestButton.setEnabled(False)
+
 
 
 			setup_control_box()
@@ -791,6 +1062,8 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 			def setup_tree():
 				nonlocal self
 				self.treeWidget = QTreeView(self.treeTab)
+				self.tree_model = QJsonModel()
+				self.treeWidget.setModel(self.tree_model)
 				self.treeWidget.expandAll()
 				self.treeWidget.resizeColumnToContents(0)
 
@@ -814,6 +1087,7 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 
 				setup_table_tab()
 				setup_tree_tab()
+				self.tabWidget.currentChanged.connect(lambda _: self.update_tree_view())
 
 				# self.tabWidget.setCurrentIndex(1)
 
@@ -860,12 +1134,48 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 				self.statusbarStatusLabel.setText("Application Status: " + text)
 				self.statusbarStatusLabel.setStyleSheet(f"QLabel {{ color : {color} }}")
 
+			def setup_rate_limit_label(text, color="black"):
+				nonlocal self
+				self.statusbarRateLimitLabel = gui.widgetLabel(self.statusBar(), label="Rate limit: " + text)
+				self.statusbarRateLimitLabel.setStyleSheet(f"QLabel {{ color : {color} }}")
+
+			def change_rate_limit_label(text, color="black"):
+				nonlocal self
+				self.statusbarRateLimitLabel.setText("Rate limit: " + text)
+				self.statusbarRateLimitLabel.setStyleSheet(f"QLabel {{ color : {color} }}")
+
+			def setup_connections_label(text, color="black"):
+				nonlocal self
+				self.statusbarConnectionsLabel = gui.widgetLabel(self.statusBar(), label="Connections: " + text)
+				self.statusbarConnectionsLabel.setStyleSheet(f"QLabel {{ color : {color} }}")
+
+			def change_connections_label(text, color="black"):
+				nonlocal self
+				self.statusbarConnectionsLabel.setText("Connections: " + text)
+				self.statusbarConnectionsLabel.setStyleSheet(f"QLabel {{ color : {color} }}")
+
 			self.change_res_size_label = change_res_size_label
 			self.change_app_status_label = change_app_status_label
 			self.change_http_status_label = change_http_status_label
+			def setup_cache_label(text, color="black"):
+				nonlocal self
+				self.statusbarCacheLabel = gui.widgetLabel(self.statusBar(), label="Cache: " + text)
+				self.statusbarCacheLabel.setStyleSheet(f"QLabel {{ color : {color} }}")
+
+			def change_cache_label(text, color="black"):
+				nonlocal self
+				self.statusbarCacheLabel.setText("Cache: " + text)
+				self.statusbarCacheLabel.setStyleSheet(f"QLabel {{ color : {color} }}")
+
+			self.change_rate_limit_label = change_rate_limit_label
+			self.change_connections_label = change_connections_label
+			self.change_cache_label = change_cache_label
 
 			setup_http_status("No requests", "black")
 			setup_app_status_label("Ready")
+			setup_rate_limit_label("idle")
+			setup_connections_label("idle")
+			setup_cache_label("idle")
 
 		setup_statusbar()
 		setup_search_box()
@@ -892,7 +1202,12 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 			verbose=self.ETSY_VERBOSE,
 			host=self.ETSY_HOST,
 			port=self.ETSY_PORT,
-			reference_file_path=self.ETSSY_API_REFERENCE_FILE_PATH
+			reference_file_path=self.ETSSY_API_REFERENCE_FILE_PATH,
+			rate_limit=self.CLIENT_RATE_LIMIT,
+			rate_burst=self.CLIENT_RATE_BURST,
+			pool_size=self.CLIENT_MAX_THREADS,
+			cache_responses=self.CACHE_RESPONSES,
+			token_refresh_skew=self.ETSY_TOKEN_REFRESH_SKEW
 		)
 
 		# this really anoyingly has to be called here because this is where
@@ -903,7 +1218,9 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 		# despite being added by get_api_routes, this is a bug
 		# self.ETSY_taxonomy_items = self.ETSY_API_CLIENT.getBuyerTaxonomyNodes()
 		# self.ETSY_taxonomy_items = Query(self.ETSY_API_CLIENT.get_buyer_taxonomy_nodes()["results"])
-		self.ETSY_taxonomy_items = self.ETSY_API_CLIENT.get_buyer_taxonomy_nodes()
+		# The stored taxonomy is used right away, a stale or missing one is fetched in the background
+		if self.taxonomy_store.stale:
+			self.refresh_taxonomy()
 
 
 		self.enable_qgroupbox_and_color_title(self.required_parameters_box)
@@ -911,9 +1228,31 @@ class OrangeEtsyApiInterface(OWWidget, SetupHelper, WidgetsHelper, RequestHelper
 		self.searchBox.setEnabled(True)
 		self.etsyClientProxyTreeMenu.setEnabled(True)
 
+	def refresh_taxonomy(self):
+		if self.taxonomy_watcher is not None and not self.taxonomy_watcher.future().done():
+			return
+		future = self.taxonomy_executor.submit(self.taxonomy_store.fetch, self.ETSY_API_CLIENT)
+		self.taxonomy_watcher = FutureWatcher(future)
+		self.taxonomy_watcher.done.connect(self.on_taxonomy_refreshed)
+
+	def on_taxonomy_refreshed(self, future):
+		try:
+			taxonomy = future.result()
+		except Exception as e:
+			self.logger.debug("Could not refresh the taxonomy: " + str(e))
+			self.change_app_status_label("Could not refresh the taxonomy, using the stored one", "orange")
+			return
+		self.change_app_status_label(f"Taxonomy updated ({len(taxonomy.get('results') or [])} top level nodes)")
+
 	def closeEvent(self, event):
 		super().closeEvent(event)
 
+	def onDeleteWidget(self):
+		self.shutdown()
+		self.taxonomy_executor.shutdown(wait=False)
+		self.close_async_requests()
+		super().onDeleteWidget()
+
 	def processEvents(self):
 		QtWidgets.QApplication.processEvents()
 
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from typing import NamedTuple
+
+from orangecontrib.etsy.widgets.lib.cache_helpers import etsy_cache_dir
+from orangecontrib.etsy.widgets.lib.route_table import Route, compile_routes
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of ApiReference (or anything pickled inside it) changes
+CACHE_VERSION = 1
+
+
+class ApiReference(NamedTuple):
+	"""The parsed api reference together with the indexes built from it"""
+	spec: dict
+	routes: dict
+	parameters: dict
+	schemas: dict
+
+
+def index_parameters(spec):
+	parameters = {}
+	for path_obj in spec["paths"].values():
+		for operation in path_obj.values():
+			for parameter in operation.get("parameters", []):
+				parameters[parameter["name"]] = parameter
+	return parameters
+
+
+def build_api_reference(spec):
+	return ApiReference(
+		spec=spec,
+		routes=compile_routes(spec),
+		parameters=index_parameters(spec),
+		schemas=spec.get("components", {}).get("schemas", {}))
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def _file_stamp(path):
+	stat = os.stat(path)
+	return stat.st_mtime_ns, stat.st_size
+
+
+def _cache_file_path(path):
+	name = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+	return os.path.join(etsy_cache_dir(), f"api_reference-{name}.pickle")
+
+
+def _read_cache(cache_path, stamp):
+	try:
+		with open(cache_path, "rb") as f:
+			cached = pickle.load(f)
+		if cached["version"] == (CACHE_VERSION, Route._fields) and cached["stamp"] == stamp:
+			return cached["reference"]
+	except FileNotFoundError:
+		pass
+	except Exception as e:
+		logger.debug(f"Ignoring unreadable api reference cache {cache_path}: {e}")
+	return None
+
+
+def _write_cache(cache_path, stamp, reference):
+	try:
+		tmp_path = cache_path + f".{os.getpid()}.tmp"
+		with open(tmp_path, "wb") as f:
+			pickle.dump({"version": (CACHE_VERSION, Route._fields), "stamp": stamp, "reference": reference},
+			            f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, cache_path)
+	except OSError as e:
+		logger.debug(f"Could not write api reference cache {cache_path}: {e}")
+
+
+def load_api_reference(path):
+	"""
+	Parse and index the api reference at `path`, once per process. The
+	indexed form is also pickled to the cache dir so a cold start does not
+	have to parse the json at all. Both are invalidated when the mtime or
+	size of the file changes.
+	"""
+	path = os.path.abspath(path)
+	stamp = _file_stamp(path)
+	with _loaded_lock:
+		loaded = _loaded.get(path)
+		if loaded is not None and loaded[0] == stamp:
+			return loaded[1]
+
+		cache_path = _cache_file_path(path)
+		reference = _read_cache(cache_path, stamp)
+		if reference is None:
+			with open(path, encoding="utf-8") as f:
+				reference = build_api_reference(json.load(f))
+			_write_cache(cache_path, stamp, reference)
+
+		_loaded[path] = (stamp, reference)
+		return reference
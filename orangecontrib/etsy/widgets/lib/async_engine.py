@@ -0,0 +1,70 @@
+import asyncio
+import json as jsonlib
+
+import aiohttp
+
+from orangecontrib.etsy.widgets.lib.transport import raise_for_etsy_status
+
+
+class AsyncRequestEngine:
+	"""
+	aiohttp based request engine for EtsyOAuth2Client. All requests share a
+	single pooled ClientSession and at most `max_concurrency` of them are in
+	flight at once, without needing a thread per request. The session is
+	bound to the event loop it is first used on, which for the widget is
+	its qasync loop.
+	"""
+	def __init__(self, client, max_concurrency=32):
+		self.client = client
+		self.max_concurrency = max_concurrency
+		self._semaphore = None
+		self._session = None
+
+	def resize(self, max_concurrency):
+		self.max_concurrency = max(int(max_concurrency), 1)
+		# Picked up by the next session, requests in flight keep the old limit
+		self._semaphore = None
+
+	async def session(self):
+		if self._session is None or self._session.closed:
+			self._session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+				trust_env=True)
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self.max_concurrency)
+		return self._session
+
+	async def fetch(self, method, uri, params=None, json=None, headers=None):
+		"""
+		Send a request and return (status, headers, payload), the payload is None for 204
+		and 304, and the text of the body for errors that aren't json
+		"""
+		session = await self.session()
+		params = {key: str(value) for key, value in (params or {}).items() if value is not None}
+		async with self._semaphore:
+			await self.client.rate_limiter.acquire_async()
+			# Read the headers per request so a refreshed token is picked up
+			request_headers = dict(self.client.session.headers)
+			request_headers.update(headers or {})
+			async with session.request(method, uri, params=params, json=json, headers=request_headers) as res:
+				if res.status in (204, 304):
+					return res.status, res.headers, None
+				if 200 <= res.status < 300:
+					return res.status, res.headers, await res.json(content_type=None)
+				body = await res.text()
+				try:
+					return res.status, res.headers, jsonlib.loads(body)
+				except ValueError:
+					return res.status, res.headers, body
+
+	async def request(self, method, uri, params=None, json=None):
+		status, _, payload = await self.fetch(method, uri, params=params, json=json)
+		if status == 204:
+			return {"status": "OK"}
+		raise_for_etsy_status(status, payload)
+		return payload
+
+	async def close(self):
+		if self._session is not None and not self._session.closed:
+			await self._session.close()
+		self._session = None
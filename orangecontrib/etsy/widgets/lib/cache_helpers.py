@@ -0,0 +1,10 @@
+import os
+
+from Orange.misc.environ import cache_dir
+
+
+def etsy_cache_dir(*parts):
+	"""Directory for the add-on's on-disk caches, inside Orange's cache dir"""
+	path = os.path.join(cache_dir(), "orange3-etsy", *parts)
+	os.makedirs(path, exist_ok=True)
+	return path
@@ -1,5 +1,6 @@
 import etsyv3.etsy_api
 import urllib.parse
+import asyncio
 import socketserver
 import http.server
 import webbrowser
@@ -16,27 +17,62 @@ import random
 import typing
 import signal
 import string
-import types
 import sched
 import time
 import json
 import os
 import re
 
+from orangecontrib.etsy.widgets.lib.api_reference import load_api_reference
+from orangecontrib.etsy.widgets.lib.async_engine import AsyncRequestEngine
+from orangecontrib.etsy.widgets.lib.cache_helpers import etsy_cache_dir
+from orangecontrib.etsy.widgets.lib.rate_limiter import shared_rate_limiter
+from orangecontrib.etsy.widgets.lib.response_cache import ResponseCache, response_ttl
+from orangecontrib.etsy.widgets.lib.route_table import Route, BoundRoute
+from orangecontrib.etsy.widgets.lib.transport import EtsyTransport, error_payload, raise_for_etsy_status
 
+# Seconds before its expiry the access token is refreshed, so pages in flight don't run into it
+TOKEN_REFRESH_SKEW = 5 * 60
 
 
+class MissingParameter(ValueError):
+	"""A required parameter of a route was not filled in, raised before anything is sent"""
+
+
+def is_missing(value):
+	# Empty line edits give "", some widgets give "None", zero and False are real values
+	return value is None or (isinstance(value, str) and value in ("", "None"))
+
 
 class EtsyOAuth2Client(etsyv3.etsy_api.EtsyAPI):
 	def __init__(self, api_token, host="0.0.0.0", port=5000,
 	             auto_close_browser=True, auto_refresh_token=False,
 	             verbose=True, auto_start_auth=True, scopes=None,
 	             access_token=None, refresh_token=None, expiry=None,
-	             reference_file_path="./api_reference.json"):
-
-		self.api_reference_json_file = open(
-			reference_file_path, encoding="utf-8")
-		self.api_reference_json = json.load(self.api_reference_json_file)
+	             reference_file_path="./api_reference.json",
+	             rate_limit=10, rate_burst=10, pool_size=10, cache_responses=True,
+	             token_refresh_skew=TOKEN_REFRESH_SKEW):
+
+		self.api_reference = load_api_reference(reference_file_path)
+		self.api_reference_json = self.api_reference.spec
+		# The paths in the api reference already start with /v3/application
+		api_base_url = urllib.parse.urlsplit(etsyv3.etsy_api.ETSY_API_BASEURL)
+		self.api_host_url = f"{api_base_url.scheme}://{api_base_url.netloc}"
+
+		# Every request of every client in the process takes a token from the same bucket
+		self.rate_limiter = shared_rate_limiter(rate=rate_limit, burst=rate_burst)
+
+		# Pooled keep-alive connections, shared by the api and the token calls.
+		# Kept over re-initialisation so the open connections are reused
+		if getattr(self, "transport", None) is None:
+			self.transport = EtsyTransport(pool_size=pool_size, rate_limiter=self.rate_limiter)
+		else:
+			self.transport.resize(pool_size)
+
+		# Responses of GET routes are kept on disk, see make_request
+		if getattr(self, "response_cache", None) is None:
+			self.response_cache = ResponseCache(etsy_cache_dir("responses"))
+		self.response_cache.enabled = cache_responses
 
 		# Construct and initialize the variables needed for the OAuth flow
 		if scopes is None:
@@ -51,6 +87,16 @@ class EtsyOAuth2Client(etsyv3.etsy_api.EtsyAPI):
 		self.port = port
 		self.scopes = scopes
 
+		# Worker threads share the token, one of them refreshes it while the others wait.
+		# Kept over re-initialisation, threads of the old token may still hold it
+		if getattr(self, "token_lock", None) is None:
+			self.token_lock = threading.RLock()
+		self.token_refresh_skew = token_refresh_skew
+		self.failed_refresh_token = None
+
+		# A timer of the previous initialisation would keep refreshing the old tokens
+		if getattr(self, "refresh_token_timer", None) is not None:
+			self.refresh_token_timer.cancel()
 		self.refresh_token_timer = None
 		self.auto_refresh_token = auto_refresh_token
 
@@ -87,6 +133,16 @@ class EtsyOAuth2Client(etsyv3.etsy_api.EtsyAPI):
 			expiry=self.expiry,
 			refresh_save=None)
 
+		# Only used by make_request_async, the session is opened on first use
+		if getattr(self, "async_engine", None) is None:
+			self.async_engine = AsyncRequestEngine(self, max_concurrency=pool_size)
+		else:
+			self.async_engine.resize(pool_size)
+
+		# Swap the plain session of the base class for the pooled one
+		self.transport.session.headers = self.session.headers
+		self.session = self.transport.session
+
 	# def __late__init(self, access_token, refresh_token, expiry):
 	# 	self.access_token = access_token
 	# 	self.refresh_token = refresh_token
@@ -99,92 +155,192 @@ class EtsyOAuth2Client(etsyv3.etsy_api.EtsyAPI):
 	# 		expiry=self.expiry,
 	# 		refresh_save=None)
 
-	def reference_opperation_to_function(self, method_obj, func="None #", prefix="__from_api_reference_", **kwargs):
-		if isinstance(func, (types.FunctionType, types.MethodType)): func = func.__name__
-		# function string
-		function_str = "def {prefix}{operationId}({args_str}{self}):return {func}(**locals())"
-		# generate the function arguments signature
-		type_translation = {
-			"integer": "int",
-			"float": "float",
-			"boolean": "bool",
-			"string": "str",
-			"array": "list",
-			"epoch": "datetime.datetime",
-		}
-		# convert all parameters to a list
-		arguments_list = [parameter["name"] + ":" + type_translation.get(parameter["schema"]["type"], "typing.Any") +
-		                  ("=None" if not parameter["required"] else "") for parameter in
-		                  method_obj.get("parameters", [])]
-		# add function kwargs to the arguments list as well
-		arguments_list.extend(
-			[f"{key}='{value}'" if isinstance(value, str) else f"{key}={value}"
-			 for key, value in kwargs.items()])
-
-		# convert the list to a string separated by commas
-		arguments_string = arguments_string if (arguments_string := ",".join(arguments_list)) != "," else ""
-		# eval and fill in the blanks
-		exec_str = function_str.format(
-			operationId=method_obj["operationId"],
-			args_str=arguments_string,
-			prefix=prefix,
-			func=func,
-			self=",self=self" if locals().get("self", None) else ""
-		)
-		exec(exec_str)
-		function_name = prefix + method_obj["operationId"]
-		function = locals()[function_name]
-		return function, function_name
-
-	def get_api_routes(self):
-		for path, path_obj in self.api_reference_json["paths"].items():
-			for method, method_obj in path_obj.items():
-				function, function_name = self.reference_opperation_to_function(
-					prefix="", method_obj=method_obj, func="self.make_request", path=path, method=method)
-				yield function_name, path, function, list(
-					set(inspect.signature(function).parameters) - set(["path", "method", "self"])), method.upper()
+	@property
+	def routes(self):
+		return self.api_reference.routes
 
-	def make_request(*args, **kwargs):
-		path = kwargs.get("path", None)
-		method = kwargs.get("method", None)
+	@property
+	def bound_routes(self):
+		# Bound once per api reference, the widget enumerates these on every verb toggle
+		if getattr(self, "_bound_routes_reference", None) is not self.api_reference:
+			self._bound_routes = {
+				operation_id: BoundRoute(self, route) for operation_id, route in self.routes.items()}
+			self._bound_routes_reference = self.api_reference
+		return self._bound_routes
 
-		if path: del kwargs["path"]
-		if method: del kwargs["method"]
+	def get_api_routes(self):
+		for operation_id, function in self.bound_routes.items():
+			route = function.route
+			yield operation_id, route.path, function, list(route.parameters), route.verb
 
-		if (self := kwargs.get("self", None)):
-			del kwargs["self"]
+	def prepare_request(self, route, **kwargs):
+		if not isinstance(route, Route):
+			route = self.routes[route]
 
-		method_obj = self.api_reference_json["paths"][path][method]
+		path_kwargs = {}
 		query_kwargs = {}
-		request_payload = None
-		# uri = etsyv3.etsy_api.ETSY_API_BASEURL.rstrip("/") + path
-		uri = etsyv3.etsy_api.ETSY_API_BASEURL.rsplit("/",3)[0] + path
-		# Loop through the paramters from the object
-		for parameter in method_obj.get("parameters", []):
-			parameter_name = parameter["name"]
-			# See if the parameter is in the provided parameters
+		for parameter_name in route.path_parameters:
+			kwarg_val = kwargs.get(parameter_name, None)
+			if is_missing(kwarg_val):
+				raise MissingParameter(f"{parameter_name} is required but not provided")
+			path_kwargs[parameter_name] = kwarg_val
+		for parameter_name in route.query_parameters:
 			kwarg_val = kwargs.get(parameter_name, None)
-			# If so see where it belongs
-			if kwarg_val:
-				if parameter["in"] == "path":
-					uri = uri.replace("{" + parameter_name + "}", str(kwarg_val))
-				elif parameter["in"] == "query" and str(kwarg_val) != "None":
-					query_kwargs[parameter_name] = kwarg_val
-				elif parameter["in"] == "header":
-					# TODO: process the header parameters
-					pass
-			# Otherwise check if they are required
-			elif parameter["schema"].get("required", None):
-				raise Exception(f"{parameter['name']} is required but not provided")
-
-		if method == "post" or method == "put":
-			request_payload = {}
-			for request_body in method_obj.get("requestBody", []):
-				# TODO: process the request body
-				pass
-
-		res = self._issue_request(uri, method=getattr(etsyv3.etsy_api.Method, method.upper()), request_payload=None, **query_kwargs)
-		return res
+			if not is_missing(kwarg_val):
+				query_kwargs[parameter_name] = kwarg_val
+			elif parameter_name in route.required:
+				raise MissingParameter(f"{parameter_name} is required but not provided")
+		# TODO: process the header parameters and the request body
+
+		uri = self.api_host_url + route.path.format_map(path_kwargs)
+		return uri, getattr(etsyv3.etsy_api.Method, route.verb), query_kwargs
+
+	@property
+	def cache_scope(self):
+		# Responses of one user (the access token starts with the user id) are never served to another
+		user_id = str(getattr(self, "access_token", "") or "").split(".", 1)[0]
+		return f"{self.api_token}:{user_id}"
+
+	def lookup_cached_response(self, route, uri, query_kwargs):
+		"""Returns (key, entry) for a GET route, key is None if the route is not cached"""
+		if route.verb != "GET" or not self.response_cache.enabled:
+			return None, None
+		key = self.response_cache.key(route.operation_id, uri, query_kwargs, scope=self.cache_scope)
+		return key, self.response_cache.get(key)
+
+	def handle_cached_response(self, route, key, entry, status, headers, payload):
+		"""Store a fresh response or reuse the cached entry if Etsy says it is not modified"""
+		cache = self.response_cache
+		if status == 304 and entry is not None:
+			cache.stats.increment("revalidated")
+			cache.refresh(key, entry)
+			return entry.payload
+		cache.stats.increment("misses")
+		if not 200 <= status < 300:
+			raise_for_etsy_status(status, payload)
+			# A redirect, or a 304 without anything cached to reuse
+			raise requests.HTTPError(f"{status} Error: {payload}")
+		if status == 204:
+			return {"status": "OK"}
+		# Only complete responses are kept, anything else would be served for the whole ttl
+		if status == 200:
+			ttl = response_ttl(cache.ttl_for(route.operation_id), headers.get("Cache-Control"))
+			if ttl is not None:
+				cache.put(key, payload, ttl, etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"))
+		return payload
+
+	def make_request(self, route, **kwargs):
+		if not isinstance(route, Route):
+			route = self.routes[route]
+		uri, method, query_kwargs = self.prepare_request(route, **kwargs)
+		key, entry = self.lookup_cached_response(route, uri, query_kwargs)
+		if key is None:
+			return self._issue_request(uri, method=method, request_payload=None, **query_kwargs)
+		if entry is not None and entry.fresh:
+			self.response_cache.stats.increment("hits")
+			return entry.payload
+		return self.call_with_fresh_token(self.fetch_cacheable_response, route, uri, query_kwargs, key, entry)
+
+	def fetch_cacheable_response(self, route, uri, query_kwargs, key, entry):
+		res = self.session.get(
+			etsyv3.etsy_api.EtsyAPI._generate_get_uri(uri, **query_kwargs),
+			headers=entry.conditional_headers() if entry is not None else None)
+		if res.status_code in (204, 304):
+			payload = None
+		elif 200 <= res.status_code < 300:
+			payload = res.json()
+		else:
+			payload = error_payload(res)
+		return self.handle_cached_response(route, key, entry, res.status_code, res.headers, payload)
+
+	async def make_request_async(self, route, **kwargs):
+		if not isinstance(route, Route):
+			route = self.routes[route]
+		uri, method, query_kwargs = self.prepare_request(route, **kwargs)
+		key, entry = self.lookup_cached_response(route, uri, query_kwargs)
+		if key is None:
+			return await self.call_with_fresh_token_async(
+				self.async_engine.request, route.verb, uri, params=query_kwargs)
+		if entry is not None and entry.fresh:
+			self.response_cache.stats.increment("hits")
+			return entry.payload
+
+		async def fetch():
+			status, headers, payload = await self.async_engine.fetch(
+				route.verb, uri, params=query_kwargs,
+				headers=entry.conditional_headers() if entry is not None else None)
+			return self.handle_cached_response(route, key, entry, status, headers, payload)
+		return await self.call_with_fresh_token_async(fetch)
+
+	def _issue_request(self, uri, *args, **kwargs):
+		return self.call_with_fresh_token(self.send_request, uri, *args, **kwargs)
+
+	def send_request(self, uri, *args, **kwargs):
+		if datetime.datetime.utcnow() >= self.expiry:
+			# The base class would call refresh() and try again, over and over
+			raise etsyv3.etsy_api.Unauthorised({"error": "invalid_token", "error_description": "access token is expired"})
+		# The transport takes the token of the rate limiter, for the retries as well
+		return super()._issue_request(uri, *args, **kwargs)
+
+	def token_expiring(self):
+		# Never more than half the lifetime of the token early, or it would be refreshed all the time
+		skew = min(self.token_refresh_skew, getattr(self, "expires_in", 0) / 2)
+		return datetime.datetime.utcnow() >= self.expiry - datetime.timedelta(seconds=skew)
+
+	def try_refresh_token(self):
+		# Must be called with the token lock held, returns whether there is a new token
+		if self.refresh_token == self.failed_refresh_token:
+			# Don't ask again with a refresh token that was already turned down
+			return False
+		try:
+			self.get_refresh_token()
+		except (KeyError, ValueError, requests.RequestException,
+		        etsyv3.etsy_api.BadRequest, etsyv3.etsy_api.Unauthorised) as ex:
+			self.failed_refresh_token = self.refresh_token
+			if self.verbose: print("Failed to refresh token", ex)
+			return False
+		return True
+
+	def ensure_fresh_token(self):
+		"""Refresh the token ahead of its expiry, only one of the threads that find it expiring does"""
+		if not self.token_expiring():
+			return
+		with self.token_lock:
+			# Another thread may have refreshed it while this one waited for the lock
+			if self.token_expiring():
+				self.try_refresh_token()
+
+	def refresh_after_unauthorised(self, used_token):
+		"""After a 401 for a request sent with `used_token`, returns whether retrying can use a new token"""
+		with self.token_lock:
+			if self.access_token != used_token:
+				# Already refreshed by another thread that got a 401 as well
+				return True
+			return self.try_refresh_token()
+
+	def call_with_fresh_token(self, function, *args, **kwargs):
+		"""Call `function`, if the token turned out expired anyway it's refreshed and `function` is called again"""
+		self.ensure_fresh_token()
+		used_token = self.access_token
+		try:
+			return function(*args, **kwargs)
+		except etsyv3.etsy_api.Unauthorised:
+			if not self.refresh_after_unauthorised(used_token):
+				raise
+			return function(*args, **kwargs)
+
+	async def call_with_fresh_token_async(self, function, *args, **kwargs):
+		loop = asyncio.get_running_loop()
+		if self.token_expiring():
+			# Refreshing waits for the lock and the token endpoint, keep that off the event loop
+			await loop.run_in_executor(None, self.ensure_fresh_token)
+		used_token = self.access_token
+		try:
+			return await function(*args, **kwargs)
+		except etsyv3.etsy_api.Unauthorised:
+			if not await loop.run_in_executor(None, self.refresh_after_unauthorised, used_token):
+				raise
+			return await function(*args, **kwargs)
 
 	# Disable builtin refresh token method by overriding it
 	def refresh(self):pass
@@ -239,15 +395,13 @@ class EtsyOAuth2Client(etsyv3.etsy_api.EtsyAPI):
 				parent_context.code = query_parameters["code"][0]
 				parent_context.state = query_parameters["state"][0]
 
-				# These can't make use of the requests.session object because it's not initialized yet
-				res = requests.post("https://api.etsy.com/v3/public/oauth/token",
-				        headers={"Content-Type": "application/json"}, json={
+				res = parent_context.transport.post_token({
 						"grant_type": "authorization_code",
 						"client_id": parent_context.api_token,
 						"redirect_uri": parent_context.redirect_uri,
 						"code": parent_context.code,
 						"code_verifier": parent_context.code_verifier
-					},verify=False)
+					}, verify=False)
 				tokens = res.json()
 				message = "Successfully retrieved tokens" if res.status_code == 200 \
 					else "Failed to retrieve tokens"
@@ -294,27 +448,50 @@ class EtsyOAuth2Client(etsyv3.etsy_api.EtsyAPI):
 
 	def start_auto_refreshing_token(self):
 		if self.refresh_token_timer: self.refresh_token_timer.cancel()
-		self.refresh_token_timer = threading.Timer(int(self.expires_in), function=self.get_refresh_token)
+		# Ahead of the expiry, the same margin requests use in token_expiring. At least
+		# a second, so a clock that is off a little can't make the timer spin
+		skew = min(self.token_refresh_skew, int(self.expires_in) / 2)
+		interval = (self.expiry - datetime.timedelta(seconds=skew) - datetime.datetime.utcnow()).total_seconds()
+		self.refresh_token_timer = threading.Timer(max(interval, 1), function=self.refresh_token_on_timer)
+		self.refresh_token_timer.daemon = True
 		self.refresh_token_timer.start()
 		if self.verbose: print("New timer started with interval", self.refresh_token_timer.interval)
 
-	def get_refresh_token(self):
-		# These can't make use of the requests.session object because it's not in this object
-		res = requests.post("https://api.etsy.com/v3/public/oauth/token",
-		                    headers={"Content-Type": "application/json"}, json={
-				"grant_type": "refresh_token",
-				"client_id": self.api_token,
-				"refresh_token": self.refresh_token
-			}, verify=False)
-		tokens = res.json()
-
-		self.access_token = tokens["access_token"]
-		self.refresh_token = tokens["refresh_token"]
-		self.expires_in = tokens["expires_in"]
-		self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.expires_in)
+	def refresh_token_on_timer(self):
+		with self.token_lock:
+			if threading.current_thread() is not self.refresh_token_timer:
+				# Cancelled while waiting for the lock, a refresh of another thread started a new timer
+				return
+			if self.token_expiring():
+				# A successful refresh starts the next timer itself
+				if self.try_refresh_token(): return
+				if self.refresh_token == self.failed_refresh_token:
+					# Turned down, requests will get a 401 and the user has to authorize again
+					self.refresh_token_timer = None
+					return
+			if self.auto_refresh_token:
+				# Fired early, wait for the rest of the margin
+				self.start_auto_refreshing_token()
 
-		if hasattr(self, "session"):
-			self.session.headers["Authorization"] = "Bearer " + self.token
+	def get_refresh_token(self):
+		# The timer thread and the worker threads all come through here
+		with self.token_lock:
+			res = self.transport.post_token({
+					"grant_type": "refresh_token",
+					"client_id": self.api_token,
+					"refresh_token": self.refresh_token
+				}, verify=False)
+			tokens = res.json()
+			raise_for_etsy_status(res.status_code, tokens)
+
+			self.access_token = tokens["access_token"]
+			self.refresh_token = tokens["refresh_token"]
+			self.expires_in = tokens["expires_in"]
+			self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.expires_in)
+
+			if hasattr(self, "session"):
+				# A single item assignment, requests of other threads see either the old or the new token
+				self.session.headers["Authorization"] = "Bearer " + self.token
 
 		if self.verbose: print("Succesfully refreshed token", self.access_token, self.refresh_token, self.expires_in)
 		if self.auto_refresh_token:
@@ -341,11 +518,10 @@ if __name__ == "__main__":
 	client.stop_auto_refreshing_token()
 
 	routes = list(client.get_api_routes())
-	client.get_api_routes()
 	pprint.pprint(routes)
 
-	func = __from_api_reference_getShop
+	func = client.bound_routes["getShop"]
 
-	print(inspect.signature(func))
-	res = func(shop_id=None)
+	print(func, func.parameters)
+	res = func(shop_id=input("SHOP ID "))
 	print("Response: ", res)
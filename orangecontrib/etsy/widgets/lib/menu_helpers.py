@@ -3,36 +3,113 @@ from PyQt5.QtWidgets import *
 
 
 
+class TaxonomyIndex:
+	"""Flat lookup tables over a taxonomy tree, for the type-ahead search"""
+	def __init__(self, results):
+		self.results = results
+		self.by_label = {}
+		self.by_name = {}
+		stack = list(reversed(results))
+		while stack:
+			node = stack.pop()
+			self.by_label[self.label(node)] = node
+			self.by_name.setdefault(node["name"].lower(), []).append(node)
+			stack.extend(reversed(node["children"] or []))
+
+	@staticmethod
+	def label(node):
+		return f"{node['name']} ({node['id']})"
+
+	@property
+	def labels(self):
+		return list(self.by_label)
+
+
+# The same taxonomy is shown for every route with a taxonomy_id, so the last index is kept around
+_last_taxonomy_index = None
+
+
+def taxonomy_index(results):
+	global _last_taxonomy_index
+	if _last_taxonomy_index is None or _last_taxonomy_index.results is not results:
+		_last_taxonomy_index = TaxonomyIndex(results)
+	return _last_taxonomy_index
+
+
 class TaxonomyMenu(QMenu):
 	def __init__(self, *args, results, parrent_button=None, **kwargs):
 		super().__init__(*args, **kwargs)
 		self.parrent_button = parrent_button
+		self.results = results
+
+		self.add_search_box()
+		# Only the top level is built here, sub menus are filled in when they are first shown
+		self.traverse(results, self, self)
 		self.resize( self.sizeHint().width(), 
 		             self.sizeHint().height())
-		
-		self.traverse(results, self, self)
-	
+
+	def add_search_box(self):
+		self.search_box = QLineEdit()
+		self.search_box.setPlaceholderText("Search taxonomy...")
+		self.search_box.setClearButtonEnabled(True)
+		# The index (and the completer) are only built once something is typed
+		self.search_box.textEdited.connect(self.on_search_text_edited)
+		search_action = QWidgetAction(self)
+		search_action.setDefaultWidget(self.search_box)
+		self.addAction(search_action)
+		self.addSeparator()
+
+	def on_search_text_edited(self, text):
+		if self.search_box.completer() is not None:
+			return
+		self.index = taxonomy_index(self.results)
+		completer = QCompleter(self.index.labels, self.search_box)
+		completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+		completer.setFilterMode(QtCore.Qt.MatchContains)
+		completer.activated[str].connect(self.on_search_activated)
+		self.search_box.setCompleter(completer)
+		completer.setCompletionPrefix(text)
+		completer.complete()
+
+	def on_search_activated(self, label):
+		node = self.index.by_label.get(label)
+		if node is None:
+			return
+		self.select(node["id"], node["name"], node["level"], node["full_path_taxonomy_ids"])
+		self.search_box.clear()
+		self.close()
+
 	def on_menu_item_clicked(self, *args, **kwargs):
 		element = self.sender()
-		title = f"{element.taxonomy_name} ({element.taxonomy_id})"
+		self.select(element.taxonomy_id, element.taxonomy_name,
+		            element.taxonomy_level, element.taxonomy_full_path_taxonomy_ids)
+
+	def select(self, taxonomy_id, taxonomy_name, taxonomy_level, taxonomy_full_path_taxonomy_ids):
+		title = f"{taxonomy_name} ({taxonomy_id})"
 		self.setTitle(title)
 		self.resize(
 			self.sizeHint().width(),
 			self.sizeHint().height())
 		if self.parrent_button:
-			self.parrent_button.taxonomy_id = element.taxonomy_id
-			self.parrent_button.taxonomy_name = element.taxonomy_name
-			self.parrent_button.taxonomy_level = element.taxonomy_level
-			self.parrent_button.taxonomy_full_path_taxonomy_ids = element.taxonomy_full_path_taxonomy_ids
+			self.parrent_button.taxonomy_id = taxonomy_id
+			self.parrent_button.taxonomy_name = taxonomy_name
+			self.parrent_button.taxonomy_level = taxonomy_level
+			self.parrent_button.taxonomy_full_path_taxonomy_ids = taxonomy_full_path_taxonomy_ids
 			# self.parrent_button.taxonomy_children = element.taxonomy_children
 			self.parrent_button.setText(title)
-			self.parrent_button.setObjectName("taxonomy_button_" + element.taxonomy_name)
+			self.parrent_button.setObjectName("taxonomy_button_" + taxonomy_name)
 			self.parrent_button.resize(
 				self.parrent_button.sizeHint().width(),
 				self.parrent_button.sizeHint().height())
-		
+
+	def on_sub_menu_about_to_show(self):
+		sub_menu = self.sender()
+		if sub_menu.taxonomy_children is not None:
+			children, sub_menu.taxonomy_children = sub_menu.taxonomy_children, None
+			self.traverse(children, sub_menu, self)
 
 	def traverse(self, results, parent_menu, original_menu):
+		# Adds one level of the tree, the children of sub menus are added on demand
 		for child in results:
 			taxonomy_id = child["id"]
 			taxonomy_name = child["name"]
@@ -47,9 +124,11 @@ class TaxonomyMenu(QMenu):
 				sub_menu.taxonomy_name = taxonomy_name
 				sub_menu.taxonomy_level = taxonomy_level
 				sub_menu.taxonomy_full_path_taxonomy_ids = taxonomy_full_path_taxonomy_ids
+				sub_menu.taxonomy_children = taxonomy_children
 
-				sub_menu.aboutToShow.connect(self.on_menu_item_clicked)
-				self.traverse(taxonomy_children, sub_menu, original_menu)
+				# Populate first, so the menu has its items by the time it is shown
+				sub_menu.aboutToShow.connect(original_menu.on_sub_menu_about_to_show)
+				sub_menu.aboutToShow.connect(original_menu.on_menu_item_clicked)
 			else:
 				title = f"{taxonomy_name} ({taxonomy_id})"
 				# title = f"{taxonomy_id} {taxonomy_name}"
@@ -59,7 +138,7 @@ class TaxonomyMenu(QMenu):
 				menu_node.taxonomy_level = taxonomy_level
 				menu_node.taxonomy_full_path_taxonomy_ids = taxonomy_full_path_taxonomy_ids
 				
-				menu_node.triggered.connect(self.on_menu_item_clicked)
+				menu_node.triggered.connect(original_menu.on_menu_item_clicked)
 
 class TaxonomyMenuButton(QPushButton):
 	def __init__(self, *args, title, results, **kwargs):
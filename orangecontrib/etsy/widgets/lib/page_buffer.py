@@ -0,0 +1,97 @@
+import time
+
+import pandas as pd
+
+
+def merge_pages(pages):
+	"""
+	One response from the (offset, response) pairs of the pages, with the rows in
+	offset order. The rows are written into a list sized once from all pages, and
+	`count` is the total the api reported rather than a sum over pages.
+	"""
+	pages = sorted(((offset, response or {}) for offset, response in pages), key=lambda page: page[0])
+	if not pages:
+		return {}
+	if len(pages) == 1:
+		return pages[0][1]
+
+	rows = [None] * sum(len(response.get("results") or ()) for _, response in pages)
+	start = 0
+	for _, response in pages:
+		page_rows = response.get("results") or ()
+		rows[start:start + len(page_rows)] = page_rows
+		start += len(page_rows)
+
+	# Anything else in a response is the same on every page
+	merged = {key: value for key, value in pages[0][1].items() if key != "results"}
+	counts = [response["count"] for _, response in pages if isinstance(response.get("count"), int)]
+	if counts:
+		merged["count"] = max(counts)
+	merged["results"] = rows
+	return merged
+
+
+class PageCollector:
+	"""
+	Bookkeeping for the pages of one paginated request, shared by the
+	threaded and the asyncio request paths. Pages are scheduled with a
+	cancellable handle (a concurrent or an asyncio future) and added as
+	they complete. The results of the pages are the only copy of their rows,
+	partial frames for streaming are built from them.
+	"""
+	def __init__(self, stop_on_short_page=False, stream=False, emit_rows=1000, emit_seconds=2.0):
+		self.stop_on_short_page = stop_on_short_page
+		self.stream = stream
+		self.emit_rows = emit_rows
+		self.emit_seconds = emit_seconds
+		self.results = []
+		self.num_rows = 0
+		self.pending = {}
+		self.total_pages = 0
+		self._last_emit_time = time.monotonic()
+		self._last_emit_rows = 0
+
+	@property
+	def done(self):
+		return len(self.results) == self.total_pages
+
+	def schedule(self, handle, offset, limit):
+		self.pending[offset] = handle
+		self.total_pages += 1
+		return handle
+
+	def add(self, result):
+		"""Add the {(offset, limit): response} result of a page, returns the response"""
+		self.results.append(result)
+		(offset, limit), response = next(iter(result.items()))
+		self.pending.pop(offset, None)
+		page_rows = len((response or {}).get("results") or [])
+		self.num_rows += page_rows
+
+		# A short page means the end of the result set, anything after it would come back empty
+		if self.stop_on_short_page and page_rows < limit:
+			for pending_offset, handle in list(self.pending.items()):
+				if pending_offset > offset and handle.cancel():
+					del self.pending[pending_offset]
+					self.total_pages -= 1
+		return response
+
+	def merged(self):
+		"""The response of all added pages together, see merge_pages"""
+		return merge_pages(
+			(offset, response) for result in self.results for (offset, _), response in result.items())
+
+	def to_dataframe(self):
+		"""The rows of the pages added so far, in offset order"""
+		return pd.DataFrame(self.merged().get("results") or [])
+
+	def should_emit(self):
+		# The last page is never emitted as partial data, the full result follows right after
+		if not self.stream or self.done:
+			return False
+		return self.num_rows - self._last_emit_rows >= self.emit_rows \
+			or time.monotonic() - self._last_emit_time >= self.emit_seconds
+
+	def mark_emitted(self):
+		self._last_emit_time = time.monotonic()
+		self._last_emit_rows = self.num_rows
@@ -25,6 +25,8 @@ Changes:
               >>> with open("file.json") as f:
               ...    document = json.load(f)
               ...    model.load(document)
+    4. Children are created from the loaded document when their parent
+       is expanded, in batches (canFetchMore/fetchMore)
 """
 
 import json
@@ -33,15 +35,23 @@ from PyQt5 import QtWidgets, QtCore#, __binding__
 
 
 class QJsonTreeItem(object):
-    def __init__(self, parent=None):
-        self._parent = parent
+    __slots__ = ("_parent", "_row", "_sort", "_keys", "_children", "key", "value", "type", "source")
 
-        self._key = ""
-        self._value = ""
-        self._type = None
+    def __init__(self, parent=None, row=0, sort=True):
+        self._parent = parent
+        self._row = row
+        self._sort = sort
+        self._keys = None
         self._children = list()
 
+        self.key = ""
+        self.value = ""
+        self.type = None
+        # The dict or list the children are created from, as they are fetched
+        self.source = None
+
     def appendChild(self, item):
+        item._row = len(self._children)
         self._children.append(item)
 
     def child(self, row):
@@ -51,70 +61,71 @@ class QJsonTreeItem(object):
         return self._parent
 
     def childCount(self):
+        """Number of children created so far"""
         return len(self._children)
 
-    def row(self):
-        return (
-            self._parent._children.index(self)
-            if self._parent else 0
-        )
-
-    @property
-    def key(self):
-        return self._key
-
-    @key.setter
-    def key(self, key):
-        self._key = key
-
-    @property
-    def value(self):
-        return self._value
-
-    @value.setter
-    def value(self, value):
-        self._value = value
-
-    @property
-    def type(self):
-        return self._type
+    def totalChildCount(self):
+        if self.source is None:
+            return len(self._children)
+        return len(self.source)
+
+    def hasChildren(self):
+        return self.totalChildCount() > 0
+
+    def canFetchMore(self):
+        return len(self._children) < self.totalChildCount()
+
+    def fetchMore(self, count=None):
+        """Create up to `count` more children from `source`, all of them if None"""
+        start = len(self._children)
+        total = self.totalChildCount()
+        stop = total if count is None else min(total, start + count)
+        if isinstance(self.source, dict):
+            if self._keys is None:
+                self._keys = sorted(self.source) if self._sort else list(self.source)
+            keys = self._keys[start:stop]
+        else:
+            keys = range(start, stop)
+        for row, key in enumerate(keys, start):
+            child = self.load(self.source[key], self, self._sort, row)
+            child.key = key
+            self._children.append(child)
+        return stop - start
+
+    def pending(self):
+        """(key, value) of the children that have not been created yet"""
+        start = len(self._children)
+        if isinstance(self.source, dict):
+            if self._keys is None:
+                self._keys = sorted(self.source) if self._sort else list(self.source)
+            keys = self._keys[start:]
+        elif self.source is not None:
+            keys = range(start, len(self.source))
+        else:
+            keys = ()
+        return ((key, self.source[key]) for key in keys)
 
-    @type.setter
-    def type(self, typ):
-        self._type = typ
+    def row(self):
+        return self._row
 
     @classmethod
-    def load(self, value, parent=None, sort=True):
-        rootItem = QJsonTreeItem(parent)
+    def load(cls, value, parent=None, sort=True, row=0):
+        """Only the item for `value` itself, its children are created by fetchMore"""
+        rootItem = cls(parent, row, sort)
         rootItem.key = "root"
+        rootItem.type = type(value)
 
-        if isinstance(value, dict):
-            items = (
-                sorted(value.items())
-                if sort else value.items()
-            )
-
-            for key, value in items:
-                child = self.load(value, rootItem)
-                child.key = key
-                child.type = type(value)
-                rootItem.appendChild(child)
-
-        elif isinstance(value, list):
-            for index, value in enumerate(value):
-                child = self.load(value, rootItem)
-                child.key = index
-                child.type = type(value)
-                rootItem.appendChild(child)
-
+        if isinstance(value, (dict, list)):
+            rootItem.source = value
         else:
             rootItem.value = value
-            rootItem.type = type(value)
 
         return rootItem
 
 
 class QJsonModel(QtCore.QAbstractItemModel):
+    FETCH_BATCH_SIZE = 500
+
     def __init__(self, parent=None):
         super(QJsonModel, self).__init__(parent)
 
@@ -135,15 +146,20 @@ class QJsonModel(QtCore.QAbstractItemModel):
             "not %s" % type(document)
         )
 
-        self.beginResetModel()
+        rootItem = QJsonTreeItem.load(document)
+        rootItem.type = type(document)
+        self.setRootItem(rootItem)
 
-        self._rootItem = QJsonTreeItem.load(document)
-        self._rootItem.type = type(document)
+        return True
 
+    def setRootItem(self, rootItem):
+        """Swap in a tree built with QJsonTreeItem.load, e.g. on a worker thread"""
+        self.beginResetModel()
+        self._rootItem = rootItem
+        # Views fetch the children of the items they expand, the top level is ours
+        rootItem.fetchMore(self.FETCH_BATCH_SIZE)
         self.endResetModel()
 
-        return True
-
     def json(self, root=None):
         """Serialise model as JSON-compliant dictionary
         Arguments:
@@ -234,6 +250,29 @@ class QJsonModel(QtCore.QAbstractItemModel):
 
         return parentItem.childCount()
 
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return False
+
+        if not parent.isValid():
+            return self._rootItem.hasChildren()
+        return parent.internalPointer().hasChildren()
+
+    def canFetchMore(self, parent):
+        if not parent.isValid():
+            return self._rootItem.canFetchMore()
+        return parent.internalPointer().canFetchMore()
+
+    def fetchMore(self, parent):
+        item = parent.internalPointer() if parent.isValid() else self._rootItem
+        start = item.childCount()
+        count = min(self.FETCH_BATCH_SIZE, item.totalChildCount() - start)
+        if count <= 0:
+            return
+        self.beginInsertRows(parent, start, start + count - 1)
+        item.fetchMore(count)
+        self.endInsertRows()
+
     def columnCount(self, parent=QtCore.QModelIndex()):
         return 2
 
@@ -253,6 +292,8 @@ class QJsonModel(QtCore.QAbstractItemModel):
             for i in range(nchild):
                 ch = item.child(i)
                 document[ch.key] = self.genJson(ch)
+            # Children that were never fetched can't have been edited
+            document.update(item.pending())
             return document
 
         elif item.type == list:
@@ -260,6 +301,7 @@ class QJsonModel(QtCore.QAbstractItemModel):
             for i in range(nchild):
                 ch = item.child(i)
                 document.append(self.genJson(ch))
+            document.extend(value for _, value in item.pending())
             return document
 
         else:
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+	"""
+	Thread safe token bucket. Every request takes one token, tokens are
+	refilled at `rate` tokens per second up to a maximum of `burst` tokens.
+
+	Callers that find the bucket empty reserve a token anyway (the balance
+	goes negative) and sleep until their token has been refilled, so waiting
+	callers are served in the order they arrived.
+	"""
+	def __init__(self, rate=10, burst=10):
+		self._lock = threading.Lock()
+		self.rate = float(rate)
+		self.burst = float(burst)
+		self._tokens = float(burst)
+		self._last_refill = time.monotonic()
+		self.reset_stats()
+
+	def configure(self, rate=None, burst=None):
+		with self._lock:
+			self._refill()
+			if rate is not None:
+				self.rate = max(float(rate), 1e-6)
+			if burst is not None:
+				self.burst = max(float(burst), 1.0)
+				self._tokens = min(self._tokens, self.burst)
+
+	def reset_stats(self):
+		self.acquired = 0
+		self.throttled = 0
+		self.total_wait = 0.0
+		self.max_wait = 0.0
+		self.queue_depth = 0
+		self.peak_queue_depth = 0
+
+	def _refill(self):
+		now = time.monotonic()
+		self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+		self._last_refill = now
+
+	def _reserve(self, tokens):
+		# Must be called with the lock held, returns the time to wait
+		self._refill()
+		self._tokens -= tokens
+		wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+		self.acquired += 1
+		if wait:
+			self.throttled += 1
+			self.total_wait += wait
+			self.max_wait = max(self.max_wait, wait)
+			self.queue_depth += 1
+			self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+		return wait
+
+	def _release_waiter(self):
+		with self._lock:
+			self.queue_depth -= 1
+
+	def acquire(self, tokens=1):
+		with self._lock:
+			wait = self._reserve(tokens)
+		if wait:
+			try:
+				time.sleep(wait)
+			finally:
+				self._release_waiter()
+		return wait
+
+	async def acquire_async(self, tokens=1):
+		# Same reservation as acquire, but waits without blocking the event loop
+		with self._lock:
+			wait = self._reserve(tokens)
+		if wait:
+			try:
+				await asyncio.sleep(wait)
+			finally:
+				self._release_waiter()
+		return wait
+
+	def stats(self):
+		with self._lock:
+			return {
+				"rate": self.rate,
+				"burst": self.burst,
+				"acquired": self.acquired,
+				"throttled": self.throttled,
+				"queue_depth": self.queue_depth,
+				"peak_queue_depth": self.peak_queue_depth,
+				"total_wait": self.total_wait,
+				"max_wait": self.max_wait,
+				"avg_wait": self.total_wait / self.throttled if self.throttled else 0.0,
+			}
+
+
+# Etsy allows 10 requests per second per api key, so a single bucket is shared
+# by every client in the process
+_shared_rate_limiter = None
+_shared_rate_limiter_lock = threading.Lock()
+
+
+def shared_rate_limiter(rate=None, burst=None):
+	global _shared_rate_limiter
+	with _shared_rate_limiter_lock:
+		if _shared_rate_limiter is None:
+			_shared_rate_limiter = TokenBucket(
+				rate=10 if rate is None else rate,
+				burst=10 if burst is None else burst)
+		elif rate is not None or burst is not None:
+			_shared_rate_limiter.configure(rate=rate, burst=burst)
+	return _shared_rate_limiter
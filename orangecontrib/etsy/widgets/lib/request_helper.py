@@ -1,40 +1,119 @@
 import asyncio
 import inspect
+import sys
 import traceback
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint
+from typing import Callable, NamedTuple
 
-from PyQt5.QtWidgets import QMessageBox
+import qasync
+from PyQt5.QtWidgets import QMessageBox, QApplication
 from etsyv3.etsy_api import BadRequest, Unauthorised, NotFound, InternalError, Forbidden, Conflict
 from orangewidget.widget import Msg
 
+from orangecontrib.etsy.widgets.lib.etsy_api_client import MissingParameter
+from orangecontrib.etsy.widgets.lib.page_buffer import PageCollector
+from orangecontrib.etsy.widgets.lib.route_table import BoundRoute
+
 
 # from rich import traceback
 
 
+class RequestSnapshot(NamedTuple):
+	function: Callable
+	args: list
+	kwargs: dict
+	pages: list
+	fetch_all: bool
+	limit: int
+	max_threads: int
+
+
+class TransformOptions(NamedTuple):
+	flatten: bool
+	remove_original_columns: bool
+	# Indicator columns with at most this fraction of ones are kept sparse, 0 keeps everything dense
+	sparse_threshold: float = 0.0
+	# Operation the response belongs to, its response schema types the columns
+	operation_id: str = None
+	# How many levels of nested objects are expanded into dotted columns when flattening
+	nested_depth: int = 0
+
+
+class TransformResult(NamedTuple):
+	response: dict
+	df_json: object
+	df_flattened: object
+	df: object
+	table: object
+	warnings: list
+	fetched: bool
+	operation_id: str = None
+	stages: object = None
+
+
+class TransformStages:
+	"""
+	What the transformation of a response computed, each stage kept with the inputs
+	it was computed from: response -> base frame -> flattened frame -> Orange table.
+	A stage is only computed again when its inputs change.
+	"""
+	def __init__(self, response=None, stages=None):
+		self.response = response
+		self._stages = dict(stages or {})
+
+	def for_response(self, response):
+		# Every stage depends on the response, a different one starts over. The copy
+		# lets a worker fill in stages without touching the ones the widget holds
+		return TransformStages(response, self._stages if response is self.response else None)
+
+	def get(self, name, key, compute):
+		cached = self._stages.get(name)
+		if cached is not None and cached[0] == key:
+			return cached[1]
+		value = compute()
+		self._stages[name] = (key, value)
+		return value
+
+
+class PartialResult(NamedTuple):
+	table: object
+	rows: int
+	pages_done: int
+	pages_total: int
+
+
+# (QApplication, qasync loop) shared by every widget of the application
+_qt_event_loop = (None, None)
+# Closing sessions of deleted widgets, asyncio only keeps weak references to tasks
+_closing_tasks = set()
+
+
+def shared_qt_event_loop():
+	"""
+	The qasync loop of the running QApplication. Creating a qasync loop makes it
+	asyncio's running loop, so a loop per widget would take over the loop of every
+	widget created before it. It is stopped and closed when the application quits.
+	"""
+	global _qt_event_loop
+	app = QApplication.instance()
+	shared_app, loop = _qt_event_loop
+	if loop is None or shared_app is not app or loop.is_closed():
+		loop = qasync.QEventLoop(app, already_running=True)
+
+		def close_loop():
+			loop.stop()
+			loop.close()
+		app.aboutToQuit.connect(close_loop)
+		_qt_event_loop = (app, loop)
+	return loop
+
+
 class RequestHelper:
 	def __init__(self):
 		self.override_string_add_attribute(str, "value", property(lambda self: self))
 
 
-	def merge_dicts(self, dicts):
-		merged = {}
-		for _dict in dicts:
-			for _key, _value in _dict.items():
-				offset, limit = _key
-				for key, value in _value.items():
-					if key == "results":
-						# self.logger.debug("Num results: ", len(value))
-						pass
-					# this could be done with checking for __add__ imo, but that doesnt seem to work
-					if isinstance(value, (int, float, list, tuple)):
-						empty_default_object = __builtins__[type(value).__name__]()
-						merged[key] = merged.get(key, empty_default_object) + value
-					else:
-						self.logger.debug("Merged for " + key)
-						merged[key] = value
-		return merged
-
 	def handle_etsy_api_client_exception(self, exception):
 		ERROR_MESSAGES = {
 			BadRequest: ("400 Bad request. ", "400"),
@@ -42,12 +121,15 @@ class RequestHelper:
 			Forbidden: ("403 Forbidden. ", "403"),
 			Conflict: ("409 Conflict. ", "409"),
 			NotFound: ("404 Not found. ", "404"),
-			InternalError: ("500 Internal server error. ", "500")
+			InternalError: ("500 Internal server error. ", "500"),
+			# Caught before sending, so there is no http status
+			MissingParameter: ("Missing parameter. ", None)
 		}
 		try:
 			error_msg_prefix,status_code  = ERROR_MESSAGES[type(exception)]
 			error_msg = error_msg_prefix
-			self.change_http_status_label(error_msg, color="red")
+			if status_code is not None:
+				self.change_http_status_label(error_msg, color="red")
 			# self.transform_err = Msg(error_msg)
 			self.error(error_msg)
 			error_msg = f"{error_msg_prefix}{exception.__class__.__name__}: {exception.args[0]}"
@@ -58,51 +140,249 @@ class RequestHelper:
 			raise exception
 
 	def send_request(self):
+		if not isinstance(self.etsy_client_send_request, BoundRoute):
+			# No route selected yet, this only reports that on the status bar
+			return self.etsy_client_send_request()
+		self.reset_request_stats()
+		self.set_request_running(True)
+		if self.ASYNC_REQUESTS:
+			return self.send_request_in_event_loop()
+		# Fetching and transforming both happen on a worker thread,
+		# on_done hands the result back to the ui thread
+		self.start(self.request_task, self.snapshot_request(), self.transform_options())
+
+	def snapshot_request(self):
+		# Everything the worker needs, so it never has to touch the widget
+		return RequestSnapshot(
+			function=self.etsy_client_send_request,
+			args=list(self.ETSY_API_CLIENT_SEND_REQUEST_ARGS),
+			kwargs=dict(self.ETSY_API_CLIENT_SEND_REQUEST_KWARGS),
+			pages=list(self.etsy_request_offsets_and_limits),
+			fetch_all=self.fetch_all_pages_enabled(),
+			limit=self.paginateLimitValue,
+			max_threads=self.CLIENT_MAX_THREADS)
+
+	def request_task(self, request, options, state):
+		# The threads only bound the number of requests in flight, the rate
+		# itself is enforced by the token bucket inside the client
+		pool = ThreadPoolExecutor(max_workers=request.max_threads)
+		paramters = self.function_parameters(request.function)
+		# For some reason the offset and limit are swapped around
+		#  (which is not the way it's comming out of the function)
+		#  really strange bug, and potentially very dangerous.
+		# for limit, offset in self.etsy_request_offsets_and_limits:
+		def wrapper(offset, limit):
+			kwargs = dict(request.kwargs)
+			if "limit" in paramters: kwargs["limit"] = limit
+			if "offset" in paramters: kwargs["offset"] = offset
+			return {
+				(offset, limit):
+					request.function(*request.args, **kwargs)
+			}
+
+		def submit(offset, limit):
+			return pool.submit(wrapper, offset, limit)
+
+		collector = self.new_page_collector()
+		try:
+			if request.fetch_all:
+				# Issue the first page on its own so the total count of the result
+				# set is known, then schedule exactly the pages that are left
+				first = collector.schedule(submit(0, request.limit), 0, request.limit)
+				pages = self.pages_after_first(collector.add(first.result()), request.limit)
+			else:
+				pages = request.pages
+
+			for offset, limit in pages:
+				collector.schedule(submit(offset, limit), offset, limit)
+
+			for task in as_completed(list(collector.pending.values())):
+				if state.is_interruption_requested():
+					return None
+				if task.cancelled():
+					continue
+				collector.add(task.result())
+				state.set_progress_value(100 * len(collector.results) / collector.total_pages)
+				if collector.should_emit():
+					state.set_partial_result(self.partial_result(collector, options))
+		finally:
+			pool.shutdown(wait=False, cancel_futures=True)
+
+		return self.transform_task(collector.merged(), options, state, fetched=True)
+
+	def send_request_in_event_loop(self):
+		# qasync runs the coroutine on the Qt event loop, so the ui keeps
+		# responding while the pages are in flight
+		if self.loop is None:
+			self.loop = shared_qt_event_loop()
+		self.progressBarInit()
+		self.async_request = asyncio.ensure_future(self.send_request_async(), loop=self.loop)
+		self.async_request.add_done_callback(self.on_async_request_done)
+		return self.async_request
+
+	def on_async_request_done(self, task):
+		# Nothing awaits the request, its errors would otherwise only be logged by asyncio
+		if task.cancelled() or task.exception() is None:
+			return
+		self.progressBarFinished()
 		try:
-			# TODO: Look into a way to make this a more
-			#  time based semaphore (the api has a rate limit of 10 reqs/sec)
-			pool = ThreadPoolExecutor(max_workers=self.CLIENT_MAX_THREADS)
-			# self.logger.debug(self.paginateLimitValue, self.etsy_request_offsets_and_limits)
-			tasks = []
-			# For some reason the offset and limit are swapped around
-			#  (which is not the way it's comming out of the function)
-			#  really strange bug, and potentially very dangerous.
-			# for limit, offset in self.etsy_request_offsets_and_limits:
-			def wrapper(offset, limit, *args, **kwargs):
-				# try:
-				paramters = inspect.signature(self.etsy_client_send_request).parameters
-				if "limit" in paramters: kwargs["limit"] = limit
-				if "offset" in paramters: kwargs["offset"] = offset
-				return {
-					(offset, limit):
-						self.etsy_client_send_request(*args, **kwargs)
-				}
-				# except Exception as e:
-
-			for offset, limit in self.etsy_request_offsets_and_limits:
-				task = pool.submit(
-						wrapper,
-						limit=limit,
-						offset=offset,
-						*self.ETSY_API_CLIENT_SEND_REQUEST_ARGS,
-						**self.ETSY_API_CLIENT_SEND_REQUEST_KWARGS,
-
-				)
-				tasks.append(task)
-			results = [task.result() for task in tasks]
-			sorted_dicts = sorted(results, key=lambda x: sum(list(x.keys())[0]))
-			# self.logger.debug([d.keys() for d in sorted_dicts])
-			merged_dicts = self.merge_dicts(sorted_dicts)
-			self.ETSY_API_RESPONSE = merged_dicts
-			self.change_http_status_label("200 OK", color="green")
-			self.populate_data()
-		except Exception as e:
-			self.handle_etsy_api_client_exception(e)
+			self.on_exception(task.exception())
+		except Exception:
+			# Not an api error, to the exception hook like the errors of the worker thread
+			sys.excepthook(*sys.exc_info())
+
+	async def send_request_async(self):
+		request = self.snapshot_request()
+		options = self.transform_options()
+		parameters = self.function_parameters(request.function)
+
+		async def fetch(offset, limit):
+			kwargs = dict(request.kwargs)
+			if "limit" in parameters: kwargs["limit"] = limit
+			if "offset" in parameters: kwargs["offset"] = offset
+			return {(offset, limit): await self.ETSY_API_CLIENT.make_request_async(request.function.route, **kwargs)}
+
+		def submit(offset, limit):
+			return asyncio.ensure_future(fetch(offset, limit), loop=self.loop)
+
+		collector = self.new_page_collector()
+		try:
+			if request.fetch_all:
+				first = collector.schedule(submit(0, request.limit), 0, request.limit)
+				pages = self.pages_after_first(collector.add(await first), request.limit)
+			else:
+				pages = request.pages
+
+			for offset, limit in pages:
+				collector.schedule(submit(offset, limit), offset, limit)
 
+			for next_done in asyncio.as_completed(list(collector.pending.values())):
+				try:
+					result = await next_done
+				except asyncio.CancelledError:
+					if self.async_request is None or self.async_request.cancelled():
+						raise
+					continue
+				collector.add(result)
+				self.progressBarSet(100 * len(collector.results) / collector.total_pages)
+				if collector.should_emit():
+					# Flattening and converting to an Orange table is too slow for the ui thread,
+					# the collector only changes in this coroutine, so it is not touched meanwhile
+					partial = await self.loop.run_in_executor(None, self.partial_result, collector, options)
+					self.on_partial_result(partial)
+		finally:
+			for task in collector.pending.values():
+				task.cancel()
+			self.async_request = None
 
+		self.progressBarFinished()
+		# Only the transformation is left, which goes to the worker thread like the threaded path
+		self.start(self.transform_task, collector.merged(), options, fetched=True)
 
+	def close_async_requests(self):
+		# For the deletion of the widget, the shared loop itself stays open for the other widgets
+		if self.async_request is not None:
+			self.async_request.cancel()
+			self.async_request = None
+		if self.loop is not None:
+			task = asyncio.ensure_future(self.ETSY_API_CLIENT.async_engine.close(), loop=self.loop)
+			_closing_tasks.add(task)
+			task.add_done_callback(_closing_tasks.discard)
 
+	def cancel_request(self):
+		if self.async_request is not None:
+			self.async_request.cancel()
+			self.async_request = None
+			self.progressBarFinished()
+		self.cancel()
+		self.set_request_running(False)
+		self.change_app_status_label("Request cancelled", color="orange")
 
+	def set_request_running(self, running):
+		self.sendRequestButton.setEnabled(not running and self.ETSY_API_TOKEN is not None)
+		self.cancelRequestButton.setEnabled(running)
+		# Flattening options would restart the transformation and with it the running request
+		if running:
+			self.flattenOptionsControlBox.setEnabled(False)
+		elif self.ETSY_API_RESPONSE:
+			self.flattenOptionsControlBox.setEnabled(True)
+
+	def reset_request_stats(self):
+		self.ETSY_API_CLIENT.rate_limiter.reset_stats()
+		self.ETSY_API_CLIENT.transport.stats.reset()
+		self.ETSY_API_CLIENT.response_cache.stats.reset()
+
+	def new_page_collector(self):
+		return PageCollector(
+			stop_on_short_page=self.FETCH_ALL_PAGES,
+			stream=self.STREAM_RESULTS,
+			emit_rows=self.STREAM_EMIT_ROWS,
+			emit_seconds=self.STREAM_EMIT_SECONDS)
+
+	def fetch_all_pages_enabled(self):
+		return self.FETCH_ALL_PAGES and self.supports_pagination(self.etsy_client_send_request)
+
+	def pages_after_first(self, first_response, limit):
+		first_response = first_response or {}
+		return self.calculate_remaining_pages(
+			first_response.get("count", 0), limit, received=len(first_response.get("results") or []))
+
+	def function_parameters(self, function):
+		# Routes of the client expose their parameter names directly
+		parameters = getattr(function, "parameters", None)
+		return parameters if parameters is not None else inspect.signature(function).parameters
+
+	def supports_pagination(self, function):
+		parameters = self.function_parameters(function)
+		return "limit" in parameters and "offset" in parameters
+
+	def calculate_remaining_pages(self, count, limit, received=None):
+		"""
+		(offset, limit) pairs for the pages after the first one, based on the
+		total `count` the api reported. The first page is assumed to have
+		been requested with offset 0.
+		"""
+		if received is not None and received < limit:
+			return []
+		return [(offset, min(limit, count - offset)) for offset in range(limit, count, limit)]
+
+	def partial_result(self, collector, options):
+		# What has arrived so far, so downstream widgets can start working,
+		# the complete table is sent once every page is in
+		collector.mark_emitted()
+		df = collector.to_dataframe()
+		table = None
+		if not df.empty:
+			if options.flatten:
+				df = self.flatten_frame(df, options, warnings=[])
+			table = self.pandas_to_orange(df, options.operation_id, options.nested_depth if options.flatten else 0)
+		return PartialResult(table, collector.num_rows, len(collector.results), collector.total_pages)
+
+	def report_rate_limiter_stats(self):
+		stats = self.ETSY_API_CLIENT.rate_limiter.stats()
+		text = f"{stats['throttled']}/{stats['acquired']} throttled, " \
+		       f"peak queue {stats['peak_queue_depth']}, " \
+		       f"avg wait {stats['avg_wait']:.2f}s, max wait {stats['max_wait']:.2f}s"
+		# Orange means that the limiter was the bottleneck of the last request
+		self.change_rate_limit_label(text, color="orange" if stats["throttled"] else "black")
+		self.logger.debug("Rate limiter stats: " + str(stats))
+
+	def report_transport_stats(self):
+		stats = self.ETSY_API_CLIENT.transport.stats.as_dict()
+		text = f"{stats['connections_opened']} opened for {stats['requests']} requests " \
+		       f"({stats['reuse_ratio']:.0%} reused), {stats['retries']} retries"
+		self.change_connections_label(text, color="orange" if stats["retries"] else "black")
+		self.logger.debug("Transport stats: " + str(stats))
+
+	def report_cache_stats(self):
+		stats = self.ETSY_API_CLIENT.response_cache.stats.as_dict()
+		if not self.ETSY_API_CLIENT.response_cache.enabled:
+			text = "disabled"
+		else:
+			text = f"{stats['hits']} hits, {stats['revalidated']} revalidated, {stats['misses']} misses"
+		# Green means that (part of) the last request never left the machine
+		self.change_cache_label(text, color="green" if stats["hits"] or stats["revalidated"] else "black")
+		self.logger.debug("Cache stats: " + str(stats))
 
 	"""
 	There's this anoying thing the etsy client library does in which it uses
@@ -123,4 +403,3 @@ class RequestHelper:
 		_get_dict.restype = c.POINTER(c.py_object)
 		_get_dict.argtypes = [c.py_object]
 		_get_dict(obj).contents.value[name] = value
-
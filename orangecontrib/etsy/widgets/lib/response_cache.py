@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Seconds a cached response is served without asking Etsy again. Taxonomies and
+# carriers barely ever change, listings and shops change all the time
+DEFAULT_TTL = 5 * 60
+ROUTE_TTLS = {
+	"getBuyerTaxonomyNodes": 7 * 24 * 60 * 60,
+	"getSellerTaxonomyNodes": 7 * 24 * 60 * 60,
+	"getPropertiesByBuyerTaxonomyId": 7 * 24 * 60 * 60,
+	"getPropertiesByTaxonomyId": 7 * 24 * 60 * 60,
+	"getShippingCarriers": 24 * 60 * 60,
+	"getShop": 60 * 60,
+	"findShops": 60 * 60,
+	"findAllListingsActive": 10 * 60,
+	"ping": 0,
+}
+
+
+class CacheStats:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.hits = 0
+		self.revalidated = 0
+		self.misses = 0
+		self.stored = 0
+		self.evicted = 0
+
+	def increment(self, name, amount=1):
+		with self._lock:
+			setattr(self, name, getattr(self, name) + amount)
+
+	def as_dict(self):
+		with self._lock:
+			lookups = self.hits + self.revalidated + self.misses
+			return {
+				"hits": self.hits,
+				"revalidated": self.revalidated,
+				"misses": self.misses,
+				"stored": self.stored,
+				"evicted": self.evicted,
+				"hit_ratio": (self.hits + self.revalidated) / lookups if lookups else 0.0,
+			}
+
+
+class CacheEntry:
+	__slots__ = ("payload", "stored_at", "ttl", "etag", "last_modified")
+
+	def __init__(self, payload, stored_at, ttl, etag=None, last_modified=None):
+		self.payload = payload
+		self.stored_at = stored_at
+		self.ttl = ttl
+		self.etag = etag
+		self.last_modified = last_modified
+
+	@property
+	def fresh(self):
+		return time.time() - self.stored_at < self.ttl
+
+	@property
+	def revalidatable(self):
+		return bool(self.etag or self.last_modified)
+
+	def conditional_headers(self):
+		headers = {}
+		if self.etag:
+			headers["If-None-Match"] = self.etag
+		if self.last_modified:
+			headers["If-Modified-Since"] = self.last_modified
+		return headers
+
+	def as_dict(self):
+		return {name: getattr(self, name) for name in self.__slots__}
+
+
+def normalize_params(params):
+	# Values come from line edits, spinners and ints alike, so 100 and "100" are the same request
+	return sorted(
+		(str(key), str(value)) for key, value in (params or {}).items()
+		if value is not None and str(value) != "None")
+
+
+def response_ttl(route_ttl, cache_control):
+	"""The ttl to store a response with, None if the response must not be stored"""
+	directives = [directive.strip().lower() for directive in (cache_control or "").split(",")]
+	if "no-store" in directives:
+		return None
+	if "no-cache" in directives:
+		return 0
+	for directive in directives:
+		if directive.startswith("max-age="):
+			try:
+				return min(route_ttl, int(directive.split("=", 1)[1]))
+			except ValueError:
+				break
+	return route_ttl
+
+
+class ResponseCache:
+	"""
+	On-disk cache for the json responses of GET routes, one file per
+	response. Entries are served without a request while they are younger
+	than the ttl of their route; stale entries that came with an ETag or
+	Last-Modified header are revalidated with a conditional request.
+	The directory is kept under `max_bytes` by evicting the least recently
+	used entries, their access time is kept in the file mtime.
+	"""
+	def __init__(self, directory, max_bytes=64 * 1024 * 1024, default_ttl=DEFAULT_TTL, route_ttls=None):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.default_ttl = default_ttl
+		self.route_ttls = dict(ROUTE_TTLS if route_ttls is None else route_ttls)
+		self.enabled = True
+		self.stats = CacheStats()
+		self._lock = threading.Lock()
+		self._index = None  # {filename: (last used, size)}, read from disk on first use
+		self._total_bytes = 0
+
+	def ttl_for(self, operation_id):
+		return self.route_ttls.get(operation_id, self.default_ttl)
+
+	def key(self, operation_id, uri, params, scope=""):
+		# The uri carries the path parameters, offset and limit are part of the params
+		raw = json.dumps([scope, operation_id, uri, normalize_params(params)])
+		return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.directory, key + ".json")
+
+	def _load_index(self):
+		# Must be called with the lock held
+		if self._index is not None:
+			return
+		self._index = {}
+		os.makedirs(self.directory, exist_ok=True)
+		for entry in os.scandir(self.directory):
+			if entry.is_file() and entry.name.endswith(".json"):
+				stat = entry.stat()
+				self._index[entry.name] = (stat.st_mtime, stat.st_size)
+		self._total_bytes = sum(size for _, size in self._index.values())
+
+	def _touch(self, filename, size=None):
+		now = time.time()
+		if size is None:
+			size = self._index.get(filename, (now, 0))[1]
+		old = self._index.get(filename)
+		self._total_bytes += size - (old[1] if old else 0)
+		self._index[filename] = (now, size)
+		try:
+			os.utime(os.path.join(self.directory, filename), (now, now))
+		except OSError:
+			pass
+
+	def _forget(self, filename):
+		old = self._index.pop(filename, None)
+		if old:
+			self._total_bytes -= old[1]
+		try:
+			os.remove(os.path.join(self.directory, filename))
+		except OSError:
+			pass
+
+	def _evict(self):
+		if self._total_bytes <= self.max_bytes:
+			return
+		for filename, _ in sorted(self._index.items(), key=lambda item: item[1][0]):
+			if self._total_bytes <= self.max_bytes:
+				break
+			self._forget(filename)
+			self.stats.increment("evicted")
+
+	def get(self, key):
+		if not self.enabled:
+			return None
+		path = self._path(key)
+		with self._lock:
+			self._load_index()
+			filename = os.path.basename(path)
+			if filename not in self._index:
+				return None
+			try:
+				with open(path, "r", encoding="utf-8") as f:
+					entry = CacheEntry(**json.load(f))
+			except (OSError, ValueError, TypeError):
+				self._forget(filename)
+				return None
+			self._touch(filename)
+		return entry
+
+	def put(self, key, payload, ttl, etag=None, last_modified=None):
+		if not self.enabled or (ttl <= 0 and not (etag or last_modified)):
+			return None
+		entry = CacheEntry(payload, time.time(), ttl, etag, last_modified)
+		data = json.dumps(entry.as_dict()).encode("utf-8")
+		if len(data) > self.max_bytes:
+			return entry
+		path = self._path(key)
+		with self._lock:
+			self._load_index()
+			tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+			with open(tmp_path, "wb") as f:
+				f.write(data)
+			os.replace(tmp_path, path)
+			self._touch(os.path.basename(path), size=len(data))
+			self.stats.increment("stored")
+			self._evict()
+		return entry
+
+	def refresh(self, key, entry):
+		"""Restart the ttl of an entry that Etsy reported as not modified"""
+		return self.put(key, entry.payload, entry.ttl, entry.etag, entry.last_modified)
+
+	def clear(self):
+		with self._lock:
+			self._load_index()
+			for filename in list(self._index):
+				self._forget(filename)
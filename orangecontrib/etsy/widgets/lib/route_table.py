@@ -0,0 +1,67 @@
+from typing import NamedTuple
+
+
+class Route(NamedTuple):
+	"""
+	Immutable description of a single operation of the api reference, with
+	the parameters already split by where they go in the request.
+	"""
+	operation_id: str
+	path: str
+	method: str
+	parameters: tuple
+	path_parameters: tuple
+	query_parameters: tuple
+	header_parameters: tuple
+	required: frozenset
+	has_request_body: bool
+
+	@property
+	def verb(self):
+		return self.method.upper()
+
+	@classmethod
+	def from_operation(cls, path, method, operation):
+		parameters = operation.get("parameters", [])
+		by_location = {"path": [], "query": [], "header": []}
+		for parameter in parameters:
+			by_location.setdefault(parameter["in"], []).append(parameter["name"])
+		return cls(
+			operation_id=operation["operationId"],
+			path=path,
+			method=method,
+			parameters=tuple(parameter["name"] for parameter in parameters),
+			path_parameters=tuple(by_location["path"]),
+			query_parameters=tuple(by_location["query"]),
+			header_parameters=tuple(by_location["header"]),
+			required=frozenset(parameter["name"] for parameter in parameters if parameter.get("required")),
+			has_request_body="requestBody" in operation)
+
+
+def compile_routes(api_reference_json):
+	"""Parse the paths of the api reference into {operationId: Route}, in spec order"""
+	return {
+		operation["operationId"]: Route.from_operation(path, method, operation)
+		for path, path_obj in api_reference_json["paths"].items()
+		for method, operation in path_obj.items()
+	}
+
+
+class BoundRoute:
+	"""Callable that sends a request for `route` through `client.make_request`"""
+	__slots__ = ("client", "route", "__name__")
+
+	def __init__(self, client, route):
+		self.client = client
+		self.route = route
+		self.__name__ = route.operation_id
+
+	@property
+	def parameters(self):
+		return self.route.parameters
+
+	def __call__(self, **kwargs):
+		return self.client.make_request(self.route, **kwargs)
+
+	def __repr__(self):
+		return f"<BoundRoute {self.route.verb} {self.route.operation_id} -> {self.route.path}>"
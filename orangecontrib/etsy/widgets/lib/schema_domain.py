@@ -0,0 +1,148 @@
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from Orange.data import ContinuousVariable, DiscreteVariable, StringVariable, TimeVariable
+
+
+class SchemaColumn(NamedTuple):
+	"""An output column compiled from the response schema of an operation"""
+	name: str  # dotted for values of nested objects, e.g. price.amount
+	path: tuple  # keys leading from a result to the value
+	variable: object
+
+
+def resolve_schema(schema, schemas):
+	"""Follow $ref and merge allOf, the reference nests most of its resources that way"""
+	if "$ref" in schema:
+		return resolve_schema(schemas[schema["$ref"].rsplit("/", 1)[-1]], schemas)
+	if "allOf" in schema:
+		merged = {"properties": {}}
+		for part in schema["allOf"]:
+			part = resolve_schema(part, schemas)
+			merged.update({key: value for key, value in part.items() if key != "properties"})
+			merged["properties"].update(part.get("properties", {}))
+		merged.update({key: value for key, value in schema.items() if key != "allOf"})
+		if not merged["properties"]:
+			del merged["properties"]
+		return merged
+	return schema
+
+
+def result_schema(spec, route):
+	"""The schema of a single item of `results` in the 200 response of `route`, None if there is none"""
+	schemas = spec.get("components", {}).get("schemas", {})
+	try:
+		operation = spec["paths"][route.path][route.method]
+		schema = operation["responses"]["200"]["content"]["application/json"]["schema"]
+	except KeyError:
+		return None
+	results = resolve_schema(schema, schemas).get("properties", {}).get("results")
+	if results is None or "items" not in results:
+		return None
+	return resolve_schema(results["items"], schemas)
+
+
+def is_money(schema):
+	return set(schema.get("properties", {})) == {"amount", "divisor", "currency_code"}
+
+
+def is_epoch(name, schema):
+	return schema.get("type") == "integer" and (
+		name.endswith("_timestamp") or name.endswith("_tsz")
+		or "epoch" in schema.get("description", "").lower())
+
+
+def schema_variable(name, schema):
+	if "enum" in schema:
+		return DiscreteVariable(name, values=[str(value) for value in schema["enum"]])
+	if schema.get("type") == "boolean":
+		return DiscreteVariable(name, values=["False", "True"])
+	if is_epoch(name.rsplit(".", 1)[-1], schema):
+		return TimeVariable(name, have_date=1, have_time=1)
+	if schema.get("type") in ("integer", "number"):
+		return ContinuousVariable(name)
+	# Strings, and the arrays and objects that are not expanded
+	return StringVariable(name)
+
+
+def compile_columns(schema, schemas, path=(), depth=0):
+	"""
+	Compile the properties of `schema` into SchemaColumns, in schema order.
+	Money objects are always expanded into their amount, divisor and currency_code,
+	other objects only up to `depth` levels deep.
+	"""
+	columns = []
+	for name, property_schema in schema.get("properties", {}).items():
+		property_schema = resolve_schema(property_schema, schemas)
+		property_path = path + (name,)
+		if is_money(property_schema) or (
+				len(property_path) <= depth and property_schema.get("properties")):
+			columns.extend(compile_columns(property_schema, schemas, property_path, depth))
+		else:
+			column_name = ".".join(property_path)
+			columns.append(SchemaColumn(column_name, property_path, schema_variable(column_name, property_schema)))
+	return columns
+
+
+def object_array(values):
+	# np.array would turn equally long lists into a second dimension
+	return pd.Series(values, dtype=object).to_numpy()
+
+
+def nested_values(values, path):
+	for key in path:
+		values = [value.get(key) if isinstance(value, dict) else None for value in values]
+	return values
+
+
+def raw_values(df, column):
+	# Nested values come from the dotted column if the frame has been expanded,
+	# otherwise they are looked up in the dicts of the top level column
+	if column.name in df:
+		return df[column.name].to_numpy(dtype=object)
+	if column.path[0] not in df:
+		return np.full(len(df), None, dtype=object)
+	values = df[column.path[0]].to_numpy(dtype=object)
+	if len(column.path) > 1:
+		values = object_array(nested_values(values, column.path[1:]))
+	return values
+
+
+def missing_values(n, variable):
+	return np.full(n, np.nan) if variable.is_primitive() else np.full(n, None, dtype=object)
+
+
+def record_values(records, column, present_keys=None):
+	"""The values of `column` as they go into an Orange table, read straight from the results"""
+	key = column.path[0]
+	if present_keys is not None and key not in present_keys:
+		# Many schema properties are only returned with includes, don't walk the results for them
+		return missing_values(len(records), column.variable)
+	return encode_values(nested_values([record.get(key) for record in records], column.path[1:]), column.variable)
+
+
+def column_values(df, column):
+	"""The values of `column` as they go into an Orange table"""
+	return encode_values(raw_values(df, column), column.variable)
+
+
+def encode_values(values, variable):
+	if variable.is_discrete:
+		values = object_array(values)
+		index = pd.Index(variable.values)
+		codes = index.get_indexer(values)
+		# Booleans and numbers only match the values of the variable as strings
+		unmatched = (codes < 0) & pd.notna(values)
+		if unmatched.any():
+			codes[unmatched] = index.get_indexer(pd.Series(values[unmatched], dtype=object).astype(str))
+		codes = codes.astype(float)
+		codes[codes < 0] = np.nan
+		return codes
+	if variable.is_continuous:
+		try:
+			# None becomes nan here, anything that is not a number needs the slow path
+			return np.array(values, dtype=float)
+		except (TypeError, ValueError):
+			return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float)
+	return values if isinstance(values, np.ndarray) else object_array(values)
@@ -23,6 +23,9 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QKeySequence
 from collections import OrderedDict
 
+# Kept importable from here, it used to be defined in this module
+from orangecontrib.etsy.widgets.lib.tabletest import PandasModel, RowView, argsort_values  # noqa: F401
+
 
 class EditableTableItemDelegate(QItemDelegate):
     def createEditor(self, parent, options, index: QModelIndex):
@@ -288,67 +291,6 @@ class TableHelpersBase:
     #     self.unconditional_commit()
 
 
-class PandasModel(QtCore.QAbstractTableModel):
-    def __init__(self, df = pd.DataFrame(), parent=None):
-        QtCore.QAbstractTableModel.__init__(self, parent=parent)
-        self._df = df.copy()
-
-    def toDataFrame(self):
-        return self._df.copy()
-
-    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
-        if role != QtCore.Qt.DisplayRole:
-            return QtCore.QVariant()
-
-        if orientation == QtCore.Qt.Horizontal:
-            try:
-                return self._df.columns.tolist()[section]
-            except (IndexError, ):
-                return QtCore.QVariant()
-        elif orientation == QtCore.Qt.Vertical:
-            try:
-                # return self.df.index.tolist()
-                return self._df.index.tolist()[section]
-            except (IndexError, ):
-                return QtCore.QVariant()
-
-    def data(self, index, role=QtCore.Qt.DisplayRole):
-        if role != QtCore.Qt.DisplayRole:
-            return QtCore.QVariant()
-
-        if not index.isValid():
-            return QtCore.QVariant()
-
-        return QtCore.QVariant(str(self._df.loc[index.row(), index.column()]))
-
-    def setData(self, index, value, role):
-        row = self._df.index[index.row()]
-        col = self._df.columns[index.column()]
-        if hasattr(value, 'toPyObject'):
-            # PyQt4 gets a QVariant
-            value = value.toPyObject()
-        else:
-            # PySide gets an unicode
-            dtype = self._df[col].dtype
-            if dtype != object:
-                value = None if value == '' else dtype.type(value)
-        self._df.set_value(row, col, value)
-        return True
-
-    def rowCount(self, parent=QtCore.QModelIndex()):
-        return len(self._df.index)
-
-    def columnCount(self, parent=QtCore.QModelIndex()):
-        return len(self._df.columns)
-
-    def sort(self, column, order):
-        colname = self._df.columns.tolist()[column]
-        self.layoutAboutToBeChanged.emit()
-        self._df.sort_values(colname, ascending= order == QtCore.Qt.AscendingOrder, inplace=True)
-        self._df.reset_index(inplace=True, drop=True)
-        self.layoutChanged.emit()
-
-
 class WidgetedCell(object):
     """Set as the value of an element in a pandas DataFrame to create a widget
     NOTE: You may also want your widget to implement the getWidgetedCellState and setWidgetedCellState
@@ -368,7 +310,12 @@ class WidgetedCell(object):
         return repr(self.widget)
 
 class DataFrameModel(QtCore.QAbstractTableModel):
-    """ data model for a DataFrame class """
+    """ data model for a DataFrame class
+
+    The frame given to setDataFrame is never copied or changed, sorting and
+    filtering go through the same RowView as PandasModel, with a mask per
+    filtered column.
+    """
 
     RawDataRole = 64    # Custom Role, http://qt-project.org/doc/qt-4.8/qt.html#ItemDataRole-enum
     RawIndexRole = 65
@@ -376,50 +323,80 @@ class DataFrameModel(QtCore.QAbstractTableModel):
 
     def __init__(self):
         super(DataFrameModel, self).__init__()
-        self._df = pandas.DataFrame()
         self._orig_df = pandas.DataFrame()
-        self._pre_dyn_filter_df = None
-        self._resort = lambda : None # Null resort functon
+        self._view = RowView(self._orig_df)
+        self._needles = {}  # {col_ix: [(needle, matching distinct values), ..]} of filter()
+        self._strings = {}  # {col_ix: (codes, distinct values as strings, lowercased)}
+        self._pre_dyn_filter = None
 
 
     def setDataFrame(self, dataFrame):
         """Set or change pandas DataFrame to show"""
-        self.df = dataFrame
-        self._orig_df = dataFrame.copy()
-        self._pre_dyn_filter_df = None # Clear dynamic filter
+        self.beginResetModel()
+        self._orig_df = dataFrame
+        self._view = RowView(dataFrame)
+        self._needles = {}
+        self._strings = {}
+        self._pre_dyn_filter = None # Clear dynamic filter
+        self.endResetModel()
 
     @property
     def df(self):
-        return self._df
-    @df.setter
-    def df(self, dataFrame):
-        """Setter should only be used internal to DataFrameModel.  Others should use setDataFrame()"""
-        self.modelAboutToBeReset.emit()
-        self._df = dataFrame
-        self.modelReset.emit()
+        """The shown rows, in the shown order"""
+        return self._view.frame()
+
+    def column_values(self, col_ix):
+        return self._view.column_values(col_ix)
+
+    def column_strings(self, col_ix):
+        """Codes into the distinct values of a column, as strings and lowercased strings"""
+        strings = self._strings.get(col_ix)
+        if strings is None:
+            values = self.column_values(col_ix)
+            try:
+                codes, uniques = pandas.factorize(values, use_na_sentinel=False)
+            except TypeError:
+                # dicts and lists are not hashable
+                codes, uniques = pandas.factorize(
+                    np.array(['%s' % value for value in values], dtype=object), use_na_sentinel=False)
+            as_str = np.array(['%s' % value for value in uniques], dtype=object)
+            lowered = np.array([value.lower() for value in as_str], dtype=object)
+            strings = self._strings[col_ix] = (codes, as_str, lowered)
+        return strings
+
+    def _source_row(self, row):
+        return self._view.source_row(row)
+
+    def _set_mask(self, col_ix, mask):
+        """Replace the filter on a column, filters on other columns stay"""
+        self.beginResetModel()
+        try:
+            self._view.set_mask(col_ix, mask)
+        finally:
+            self.endResetModel()
 
     @QtCore.pyqtSlot()
     def beginDynamicFilter(self):
         """Effects of using the "filter" function will not become permanent until endDynamicFilter called"""
-        if self._pre_dyn_filter_df is None:
-            self.logger.debug("NEW DYNAMIC FILTER MODEL")
-            self._pre_dyn_filter_df = self.df.copy()
-        else:
-            # Already dynamically filtering, so don't override that
-            self.logger.debug("SAME DYNAMIC FILTER MODEL")
-            pass
+        if self._pre_dyn_filter is None:
+            self._pre_dyn_filter = (dict(self._view.masks), dict(self._needles))
+        # else already dynamically filtering, so don't override that
 
     @QtCore.pyqtSlot()
     def endDynamicFilter(self):
         """Makes permanent the effects of the dynamic filter"""
-        self.logger.debug(" * * * RESETING DYNAMIC")
-        self._pre_dyn_filter_df = None
+        self._pre_dyn_filter = None
 
     @QtCore.pyqtSlot()
     def cancelDynamicFilter(self):
         """Cancel the dynamic filter"""
-        self.df = self._pre_dyn_filter_df.copy()
-        self._pre_dyn_filter_df = None
+        if self._pre_dyn_filter is None:
+            return
+        self._view.masks, self._needles = self._pre_dyn_filter
+        self._pre_dyn_filter = None
+        self.beginResetModel()
+        self._view.update()
+        self.endResetModel()
 
 
     #------------- table display functions -----------------
@@ -429,12 +406,12 @@ class DataFrameModel(QtCore.QAbstractTableModel):
 
         if orientation == QtCore.Qt.Horizontal:
             try:
-                return '%s' % self.df.columns.tolist()[section]
+                return '%s' % self._orig_df.columns[section]
             except (IndexError, ):
                 return QtCore.QVariant()
         elif orientation == QtCore.Qt.Vertical:
             try:
-                return '%s' % self.df.index.tolist()[section]
+                return '%s' % self._orig_df.index[self._source_row(section)]
             except (IndexError, ):
                 return QtCore.QVariant()
 
@@ -445,11 +422,12 @@ class DataFrameModel(QtCore.QAbstractTableModel):
             if not index.isValid():
                 return QtCore.QVariant()
 
+            row = self._source_row(index.row())
             if role == DataFrameModel.RawIndexRole:
-                r = self.df.index[index.row()]
-                c = self.df.columns[index.column()]
+                r = self._orig_df.index[row]
+                c = self._orig_df.columns[index.column()]
                 return (r, c)
-            data = self.df.iloc[index.row(), index.column()]
+            data = self.column_values(index.column())[row]
 
 
             if role == DataFrameModel.RawDataRole:
@@ -468,40 +446,21 @@ class DataFrameModel(QtCore.QAbstractTableModel):
             return defaults | QtCore.Qt.ItemIsEditable
         return defaults
 
-    def __setData(self, index, value, role):
-        row = self.df.index[index.row()]
-        col = self.df.columns[index.column()]
-        if hasattr(value, 'toPyObject'):
-            # PyQt4 gets a QVariant
-            value = value.toPyObject()
-        else:
-            # PySide gets an unicode
-            dtype = self.df[col].dtype
-            if dtype != object:
-                value = None if value == '' else dtype.type(value)
-        self.df.set_value(row, col, value)
-        self.dataChanged.emit()
-        return True
-
     def rowCount(self, index=QtCore.QModelIndex()):
-        return self.df.shape[0]
+        return len(self._view)
 
     def columnCount(self, index=QtCore.QModelIndex()):
-        return self.df.shape[1]
+        return self._orig_df.shape[1]
 
     def sort(self, col_ix, order = QtCore.Qt.AscendingOrder):
-        if col_ix >= self.df.shape[1]:
+        if col_ix >= self._orig_df.shape[1]:
             # Column out of bounds
             return
 
         self.layoutAboutToBeChanged.emit()
-        ascending = True if order == QtCore.Qt.AscendingOrder else False
-        self.df = self.df.sort(self.df.columns[col_ix], ascending=ascending)
+        self._view.sort(col_ix, order == QtCore.Qt.AscendingOrder)
         self.layoutChanged.emit()
 
-        # Set sorter to current sort (for future filtering)
-        self._resort = partial(self.sort, col_ix, order)
-
     def filter(self, col_ix, needle):
         """Filter DataFrame view.  Case Insenstive.
         Fitlers the DataFrame view to include only rows who's value in col
@@ -513,50 +472,48 @@ class DataFrameModel(QtCore.QAbstractTableModel):
             needle (str)
                 String to search df_view for
         """
-
-        if self._pre_dyn_filter_df is not None:
-            df = self._pre_dyn_filter_df.copy()
-        else:
-            df = self.df
-        col = df.columns[col_ix]
-        # Create lowercase string version of column as series
-        s_lower = df[col].astype('str').str.lower()
-
-        # Make needle lower case too
         needle = str(needle).lower()
+        if not needle:
+            self._needles.pop(col_ix, None)
+            self._set_mask(col_ix, None)
+            return
 
-        # Actually filter
-        self.df = df[s_lower.str.contains(str(needle))]
+        codes, _, lowered = self.column_strings(col_ix)
+        # Values matching a part of the needle are the only candidates, so while
+        # typing every key only searches what matched the key before it
+        history = [(n, hits) for n, hits in self._needles.get(col_ix, ()) if n in needle]
+        if history and history[-1][0] == needle:
+            hits = history[-1][1]
+        else:
+            candidates = history[-1][1] if history else np.arange(len(lowered))
+            found = np.fromiter((needle in value for value in lowered[candidates]), dtype=bool, count=len(candidates))
+            hits = candidates[found]
+            history.append((needle, hits))
+        self._needles[col_ix] = history
 
-        # Resort
-        self._resort()
+        matched = np.zeros(len(lowered), dtype=bool)
+        matched[hits] = True
+        self._set_mask(col_ix, matched[codes])
 
     def filterIsIn(self, col_ix, include):
-        df = self._orig_df
-        col = self.df.columns[col_ix]
-
-        # Convert to string
-        s_col = df[col].astype('str')
-
-        # Filter
-        self.df = df[s_col.isin(include)]
-
-        # Resort
-        self._resort()
+        codes, as_str, _ = self.column_strings(col_ix)
+        matched = pandas.Index(as_str).isin(list(include))
+        self._needles.pop(col_ix, None)
+        self._set_mask(col_ix, matched[codes])
 
     def filterFunction(self, col_ix, function):
-        df = self.df
-        col = self.df.columns[col_ix]
-
-        self.df = df[function(df[col])]
-
-        # Resort
-        self._resort()
+        mask = np.asarray(function(self._orig_df.iloc[:, col_ix]), dtype=bool)
+        self._needles.pop(col_ix, None)
+        self._set_mask(col_ix, mask)
 
     def reset(self):
-        self.df = self._orig_df.copy()
-        self._resort = lambda: None
-        self._pre_dyn_filter_df = None
+        self.beginResetModel()
+        self._view.order = None
+        self._view.masks = {}
+        self._view.update()
+        self._needles = {}
+        self._pre_dyn_filter = None
+        self.endResetModel()
 
 
 class DataFrameSortFilterProxyModel(QSortFilterProxyModel):
@@ -581,7 +538,6 @@ class DataFrameSortFilterProxyModel(QSortFilterProxyModel):
         self._source_df = self.sourceModel().df
         # Accept all rows
         self._accepted_rows = range(0, self._source_df.shape[0])
-        self.logger.debug("SOURCE MODEL CHANGED", len(self._accepted_rows))
         if len(self._accepted_rows) > 0:
             self.setFilterString('')    # Reset the filter
         self._refilter()
@@ -981,7 +937,7 @@ class DataFrameWidget(QTableView):
             menu (QMenu)
                 Same menu passed in, with added actions
         """
-        cell_val = self.df.iget_value(row_ix, col_ix)
+        cell_val = self.df.iat[row_ix, col_ix]
 
         # Quick Filter
         def _quick_filter(s_col):
@@ -1,27 +1,196 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
 from AnyQt import QtCore
 
 
+def argsort_values(values, ascending=True):
+    """Positions that put `values` in order, missing values always go last"""
+    if values.dtype.kind in "biufmM":
+        if ascending:
+            return np.argsort(values, kind="stable")
+        # Sorting the reversed values and reversing the result keeps equal
+        # values in the order of the frame, reversing a stable sort would not
+        order = len(values) - 1 - np.argsort(values[::-1], kind="stable")[::-1]
+        # nan and NaT sort last, reversing moved them to the front
+        if values.dtype.kind in "fc":
+            missing = int(np.isnan(values).sum())
+        elif values.dtype.kind in "mM":
+            missing = int(np.isnat(values).sum())
+        else:
+            missing = 0
+        return np.concatenate([order[missing:], order[:missing]]) if missing else order
+    series = pd.Series(values, dtype=object)
+    try:
+        ordered = series.sort_values(ascending=ascending, kind="stable", na_position="last")
+    except TypeError:
+        # Mixed types or unorderable values such as dicts and lists
+        ordered = series.where(series.isna(), series.astype(str)).sort_values(
+            ascending=ascending, kind="stable", na_position="last")
+    return ordered.index.to_numpy()
+
+
+class RowView:
+    """
+    The rows of a frame as a table model shows them, sorted and filtered
+    without copying or reordering the frame. `rows` holds the positions of
+    the shown frame rows in the order they are shown, None while neither
+    sorted nor filtered. Every filter is a boolean mask over the frame rows,
+    kept under a key (e.g. the column it filters) so it can be replaced on
+    its own, a row is shown if all masks accept it.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.columns = [None] * data.columns.size
+        self.order = None  # from sort(), None while unsorted
+        self.masks = {}
+        self.rows = None
+
+    def __len__(self):
+        return len(self.data.index) if self.rows is None else len(self.rows)
+
+    def frame(self):
+        """The shown rows in the shown order"""
+        if self.rows is None:
+            return self.data
+        return self.data.iloc[self.rows]
+
+    def column_values(self, column):
+        values = self.columns[column]
+        if values is None:
+            # Positional, so duplicate column names are not a problem
+            values = self.columns[column] = self.data.iloc[:, column].to_numpy()
+        return values
+
+    def source_row(self, row):
+        return row if self.rows is None else int(self.rows[row])
+
+    def update(self):
+        mask = None
+        for column_mask in self.masks.values():
+            mask = column_mask if mask is None else mask & column_mask
+        rows = self.order
+        if mask is not None:
+            rows = np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+        self.rows = rows
+
+    def sort(self, column, ascending=True):
+        # Columns out of range (-1) restore the order of the frame
+        self.order = argsort_values(self.column_values(column), ascending) \
+            if 0 <= column < len(self.columns) else None
+        self.update()
+
+    def set_mask(self, key, mask):
+        """Replace the filter under `key`, None removes it"""
+        if mask is None:
+            self.masks.pop(key, None)
+        else:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != (len(self.data.index),):
+                raise ValueError(f"Filter mask has {mask.size} values for {len(self.data.index)} rows")
+            self.masks[key] = mask
+        self.update()
+
+
 class PandasModel(QtCore.QAbstractTableModel):
     """
     Class to populate a table view with a pandas dataframe
+
+    Sorting and filtering go through a RowView, so the frame is never copied
+    or reordered. Columns are turned into NumPy arrays the first time one of
+    their cells is shown, formatted cells are kept in a small LRU cache and
+    rows are handed to the view in batches as it scrolls down
+    (canFetchMore/fetchMore).
     """
-    def __init__(self, data, parent=None):
+    FETCH_BATCH_SIZE = 1000
+    STRING_CACHE_SIZE = 20000
+
+    def __init__(self, data=None, parent=None):
         QtCore.QAbstractTableModel.__init__(self, parent)
-        self._data = data
+        self._data = pd.DataFrame() if data is None else data
+        self._view = RowView(self._data)
+        self._num_columns = self._data.columns.size
+        self._strings = OrderedDict()
+        self._loaded_rows = min(len(self._view), self.FETCH_BATCH_SIZE)
+
+    @property
+    def df(self):
+        return self._data
+
+    def toDataFrame(self):
+        """The shown rows in the shown order"""
+        return self._view.frame()
+
+    def column_values(self, column):
+        return self._view.column_values(column)
+
+    def source_row(self, row):
+        return self._view.source_row(row)
 
     def rowCount(self, parent=None):
-        return len(self._data.values)
+        if parent is not None and parent.isValid():
+            return 0
+        return self._loaded_rows
 
     def columnCount(self, parent=None):
-        return self._data.columns.size
+        if parent is not None and parent.isValid():
+            return 0
+        return self._num_columns
+
+    def canFetchMore(self, parent=None):
+        if parent is not None and parent.isValid():
+            return False
+        return self._loaded_rows < len(self._view)
+
+    def fetchMore(self, parent=None):
+        if parent is not None and parent.isValid():
+            return
+        count = min(self.FETCH_BATCH_SIZE, len(self._view) - self._loaded_rows)
+        if count <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self._loaded_rows, self._loaded_rows + count - 1)
+        self._loaded_rows += count
+        self.endInsertRows()
+
+    def display_string(self, row, column):
+        # Keyed by frame row, so cached cells survive sorting and filtering
+        key = (row, column)
+        text = self._strings.get(key)
+        if text is None:
+            text = self._strings[key] = str(self.column_values(column)[row])
+            if len(self._strings) > self.STRING_CACHE_SIZE:
+                self._strings.popitem(last=False)
+        else:
+            self._strings.move_to_end(key)
+        return text
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if index.isValid():
             if role == QtCore.Qt.DisplayRole:
-                return str(self._data.iloc[index.row()][index.column()])
+                return self.display_string(self.source_row(index.row()), index.column())
         return None
 
-    def headerData(self, col, orientation, role):
-        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
-            return self._data.columns[col]
-        return None
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return str(self._data.columns[section])
+        return str(self._data.index[self.source_row(section)])
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        # -1 restores the order of the frame
+        self.layoutAboutToBeChanged.emit()
+        self._view.sort(column, order == QtCore.Qt.AscendingOrder)
+        self.layoutChanged.emit()
+
+    def setFilterMask(self, mask):
+        """Show only the frame rows where `mask` is True, None shows all of them"""
+        self.beginResetModel()
+        try:
+            # The only filter of this model, over whole rows rather than a column
+            self._view.set_mask(None, mask)
+        finally:
+            self._loaded_rows = min(len(self._view), self.FETCH_BATCH_SIZE)
+            self.endResetModel()
@@ -0,0 +1,70 @@
+import os
+import pickle
+import threading
+import time
+
+# Bump when the stored layout changes, older stores are then fetched again
+TAXONOMY_STORE_VERSION = 1
+TAXONOMY_TTL = 7 * 24 * 60 * 60
+
+
+class TaxonomyStore:
+	"""
+	The buyer taxonomy tree kept on disk between sessions. It is thousands
+	of nodes and almost never changes, so a stale copy is still served
+	while a fresh one is fetched in the background.
+	"""
+	def __init__(self, path, ttl=TAXONOMY_TTL):
+		self.path = path
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._loaded = False
+		self._taxonomy = None
+		self._fetched_at = None
+
+	def _load(self):
+		# Must be called with the lock held
+		if self._loaded:
+			return
+		self._loaded = True
+		try:
+			with open(self.path, "rb") as f:
+				stored = pickle.load(f)
+		except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+			return
+		if isinstance(stored, dict) and stored.get("version") == TAXONOMY_STORE_VERSION:
+			self._taxonomy = stored["taxonomy"]
+			self._fetched_at = stored["fetched_at"]
+
+	@property
+	def taxonomy(self):
+		"""The stored {"count": .., "results": [..]} response, None if there is none yet"""
+		with self._lock:
+			self._load()
+			return self._taxonomy
+
+	@property
+	def stale(self):
+		with self._lock:
+			self._load()
+			return self._taxonomy is None or time.time() - self._fetched_at >= self.ttl
+
+	def update(self, taxonomy):
+		fetched_at = time.time()
+		tmp_path = f"{self.path}.{os.getpid()}.tmp"
+		with open(tmp_path, "wb") as f:
+			pickle.dump({
+				"version": TAXONOMY_STORE_VERSION,
+				"fetched_at": fetched_at,
+				"taxonomy": taxonomy,
+			}, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, self.path)
+		with self._lock:
+			self._loaded = True
+			self._taxonomy = taxonomy
+			self._fetched_at = fetched_at
+		return taxonomy
+
+	def fetch(self, client):
+		"""Fetch the taxonomy with `client` and store it, safe to call from a worker thread"""
+		return self.update(client.get_buyer_taxonomy_nodes())
@@ -0,0 +1,163 @@
+import threading
+
+import requests
+from etsyv3.etsy_api import BadRequest, Unauthorised, NotFound, InternalError, Forbidden, Conflict
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+ETSY_OAUTH_TOKEN_URL = "https://api.etsy.com/v3/public/oauth/token"
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Same mapping as etsyv3 uses, so every engine raises the same exceptions
+ETSY_STATUS_EXCEPTIONS = {
+	400: BadRequest,
+	401: Unauthorised,
+	403: Forbidden,
+	404: NotFound,
+	409: Conflict,
+	500: InternalError,
+}
+
+
+def raise_for_etsy_status(status_code, payload):
+	exception = ETSY_STATUS_EXCEPTIONS.get(status_code)
+	if exception is not None:
+		raise exception(payload)
+	if status_code >= 400:
+		# Rate limited or unavailable after the retries, etsyv3 has no exception for these
+		raise requests.HTTPError(f"{status_code} Error: {payload}")
+
+
+def error_payload(response):
+	# Errors of proxies and gateways in front of the api are often html
+	try:
+		return response.json()
+	except ValueError:
+		return response.text
+
+
+class TransportStats:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.requests = 0
+		self.connections_opened = 0
+		self.retries = 0
+
+	def increment(self, name):
+		with self._lock:
+			setattr(self, name, getattr(self, name) + 1)
+
+	def as_dict(self):
+		with self._lock:
+			reused = max(self.requests - self.connections_opened, 0)
+			return {
+				"requests": self.requests,
+				"connections_opened": self.connections_opened,
+				"connections_reused": reused,
+				"reuse_ratio": reused / self.requests if self.requests else 0.0,
+				"retries": self.retries,
+			}
+
+
+def _counting_pool_class(base, stats, rate_limiter):
+	class CountingConnectionPool(base):
+		def urlopen(self, *args, **kwargs):
+			# urllib3 comes back through here for each retry, so every attempt takes a token
+			if rate_limiter is not None:
+				rate_limiter.acquire()
+			return super().urlopen(*args, **kwargs)
+
+		def _new_conn(self):
+			# Every new connection means a new TCP (and TLS) handshake
+			stats.increment("connections_opened")
+			return super()._new_conn()
+	return CountingConnectionPool
+
+
+def _counting_retry_class(stats):
+	class CountingRetry(Retry):
+		def increment(self, *args, **kwargs):
+			stats.increment("retries")
+			return super().increment(*args, **kwargs)
+	return CountingRetry
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+	def __init__(self, stats, rate_limiter=None, **kwargs):
+		self.stats = stats
+		self.rate_limiter = rate_limiter
+		super().__init__(**kwargs)
+
+	def init_poolmanager(self, *args, **kwargs):
+		super().init_poolmanager(*args, **kwargs)
+		self.poolmanager.pool_classes_by_scheme = {
+			"http": _counting_pool_class(HTTPConnectionPool, self.stats, self.rate_limiter),
+			"https": _counting_pool_class(HTTPSConnectionPool, self.stats, self.rate_limiter),
+		}
+
+	# Proxies get their own pool managers, so count their connections as well
+	def proxy_manager_for(self, *args, **kwargs):
+		manager = super().proxy_manager_for(*args, **kwargs)
+		manager.pool_classes_by_scheme = self.poolmanager.pool_classes_by_scheme
+		return manager
+
+
+class EtsyTransport:
+	"""
+	Keep-alive HTTP transport shared by the api calls and the OAuth token
+	calls. The connection pool is sized to the number of worker threads so
+	concurrent pages don't have to open (and TLS handshake) new connections,
+	and 429/5xx responses are retried with exponential backoff. Every attempt,
+	retries included, takes a token of `rate_limiter`.
+	"""
+	def __init__(self, pool_size=10, retries=3, backoff_factor=0.5, rate_limiter=None):
+		self.stats = TransportStats()
+		self.rate_limiter = rate_limiter
+		self.retries = retries
+		self.backoff_factor = backoff_factor
+		self.session = requests.Session()
+		self.session.hooks["response"].append(self._on_response)
+		self.pool_size = None
+		self.resize(pool_size)
+
+	def _on_response(self, response, *args, **kwargs):
+		self.stats.increment("requests")
+
+	def build_adapter(self, pool_size):
+		retry = _counting_retry_class(self.stats)(
+			total=self.retries,
+			backoff_factor=self.backoff_factor,
+			status_forcelist=RETRY_STATUS_CODES,
+			# POST is left out on purpose, token refreshes should not be replayed
+			allowed_methods=frozenset({"GET", "PUT", "DELETE", "HEAD", "OPTIONS"}),
+			respect_retry_after_header=True,
+			raise_on_status=False)
+		return PooledHTTPAdapter(
+			self.stats, self.rate_limiter, pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+
+	def resize(self, pool_size):
+		pool_size = max(int(pool_size), 1)
+		if pool_size == self.pool_size:
+			return
+		adapter = self.build_adapter(pool_size)
+		for prefix in ("https://", "http://"):
+			old_adapter = self.session.adapters.get(prefix)
+			self.session.mount(prefix, adapter)
+			if old_adapter is not None and old_adapter is not adapter:
+				old_adapter.close()
+		self.pool_size = pool_size
+
+	def post_token(self, payload, **kwargs):
+		# The token endpoint should not get the bearer token of the api session
+		return self.session.post(
+			ETSY_OAUTH_TOKEN_URL,
+			headers={"Content-Type": "application/json", "Authorization": None},
+			json=payload, **kwargs)
+
+	def close(self):
+		self.session.close()
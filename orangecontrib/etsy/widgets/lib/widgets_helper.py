@@ -8,6 +8,7 @@ import Orange
 import numpy as np
 import pandas
 import pandas as pd
+import scipy.sparse as sp
 from AnyQt.QtWidgets import QComboBox
 from Orange.data import DiscreteVariable, TimeVariable
 from Orange.data import Domain, ContinuousVariable, DiscreteVariable
@@ -15,89 +16,292 @@ from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtCore import Qt, pyqtSignal, QVariant, QSize
 from PyQt5.QtWidgets import QCheckBox, QSpinBox, QDoubleSpinBox, QLineEdit, QLabel, QHBoxLayout, QVBoxLayout, \
     QTreeWidgetItem, QPushButton, QTreeWidget, QWidget, QHeaderView, QMessageBox
-from sklearn.preprocessing import MultiLabelBinarizer
 
+from orangecontrib.etsy.widgets.lib.api_reference import load_api_reference
 from orangecontrib.etsy.widgets.lib.menu_helpers import TaxonomyMenuButton
+from orangecontrib.etsy.widgets.lib.schema_domain import (
+    result_schema, compile_columns, column_values, record_values, nested_values)
+
+
+DOMAIN_CACHE_SIZE = 16
+# Only the indicator columns of binarized lists have this dtype, columns read from json are int64
+INDICATOR_DTYPE = np.uint8
 
 
 class WidgetsHelper:
     def __init__(self):
+        self.domain_cache = OrderedDict()
+        self.schema_tables = {}
         # DATA_PATH = os.path.join(this_dir, "data", "./api_reference.json")
-        self.api_reference_json_file = open(self.ETSSY_API_REFERENCE_FILE_PATH, encoding="utf-8")
-        self.api_reference_json = json.load(self.api_reference_json_file)
+        self.api_reference = load_api_reference(self.ETSSY_API_REFERENCE_FILE_PATH)
+        self.api_reference_json = self.api_reference.spec
         self.parameters = self.get_parameters()
 
-    def create_domain(self, df):
-        attrs = []
-        newdf = pandas.DataFrame()
-        for col in df.columns:
-            val = df[col]
-            _type = val.dtype
-            if _type in [np.int64, np.float64, np.int32,
-                         np.float32, np.int16, np.float16]:
-                attr_val = ContinuousVariable(col)
-            elif _type in [np.bool_, bool]:
-                attr_val = DiscreteVariable(col, values=["False", "True"])
-            elif _type in [np.datetime64]:
-                attr_val = TimeVariable(col)
-            elif _type in [object]:
-                # self.logger.debug("Skipping obj column: ", col)
-                pass
-            # from Orange.data import Variable
-            # attr_val = Variable(col)
-            # attr_val = DiscreteVariable(np.array(col))
-            # attrs.append(StringVariable(str(col)))
-            else:
-                attr_val = None
-            if attr_val:
-                newdf[col] = val
-                attrs.append(attr_val)
-        domain = Domain(attrs)
-        return domain, newdf
-
-    def pandas_to_orange(self, df):
-        domain, attributes, metas = self.construct_domain(df)
-        orange_table = Orange.data.Table.from_numpy(domain=domain, X=df[attributes].values, Y=None,
-                                                    metas=df[metas].values, W=None)
-        return orange_table
+    def schema_columns(self, operation_id, depth=0):
+        # Compiled once per operation, the variables are then the same for every pull
+        key = (operation_id, depth)
+        if key not in self.schema_tables:
+            route = self.api_reference.routes.get(operation_id)
+            item_schema = result_schema(self.api_reference_json, route) if route is not None else None
+            self.schema_tables[key] = [] if item_schema is None \
+                else compile_columns(item_schema, self.api_reference.schemas, depth=depth)
+        return self.schema_tables[key]
+
+    def combined_domain(self, operation_id, schema_columns, inferred, indicator_columns):
+        if not schema_columns and not indicator_columns:
+            return inferred
+        key = ("combined", operation_id, tuple(column.name for column in schema_columns),
+               inferred, tuple(indicator_columns))
+        domain = self.domain_cache.get(key)
+        if domain is None:
+            # Indicators are the same variables whether they are sent dense or sparse
+            domain = self.domain_cache[key] = Orange.data.Domain(
+                attributes=[column.variable for column in schema_columns if column.variable.is_primitive()]
+                           + list(inferred.attributes)
+                           + [DiscreteVariable(name, values=["0", "1"]) for name in indicator_columns],
+                metas=[column.variable for column in schema_columns if not column.variable.is_primitive()]
+                      + list(inferred.metas))
+            if len(self.domain_cache) > DOMAIN_CACHE_SIZE:
+                self.domain_cache.popitem(last=False)
+        return domain
+
+    @staticmethod
+    def present_columns(schema_columns, names):
+        """
+        The schema columns that are in the data. Properties the route did not return and
+        columns removed by flattening are left out, instead of ending up as all missing.
+        """
+        names = set(names)
+        return [column for column in schema_columns if column.name in names or column.path[0] in names]
+
+    def pandas_to_orange(self, df, operation_id=None, depth=0):
+        # Columns described by the response schema get their variable from it, the indicator
+        # columns are 0/1 variables (the sparse ones go straight into a CSR X), only the
+        # remaining columns are inferred
+        dense_indicators = [name for name, dtype in df.dtypes.items() if dtype == INDICATOR_DTYPE]
+        sparse_indicators = [name for name, dtype in df.dtypes.items() if isinstance(dtype, pd.SparseDtype)]
+        schema_columns = self.present_columns(self.schema_columns(operation_id, depth), df.columns)
+        described = {column.path[0] for column in schema_columns}.union(
+            [column.name for column in schema_columns], dense_indicators, sparse_indicators)
+        rest = df.drop(columns=[name for name in df.columns if name in described])
+        return self.build_table(operation_id, schema_columns, partial(column_values, df), rest,
+                                df[dense_indicators] if dense_indicators else None,
+                                df[sparse_indicators] if sparse_indicators else None)
+
+    def records_to_orange(self, records, operation_id=None):
+        # Same table as pandas_to_orange(pd.DataFrame(records)), but the schema columns are
+        # read from the results directly into the table's arrays
+        schema_columns = self.schema_columns(operation_id)
+        if not schema_columns:
+            # Without a schema every column is inferred, which needs the frame anyway
+            return self.pandas_to_orange(pd.DataFrame(records), operation_id)
+        present_keys = dict.fromkeys(key for record in records for key in record)
+        schema_columns = self.present_columns(schema_columns, present_keys)
+        described = {column.path[0] for column in schema_columns}
+        rest = pd.DataFrame({key: [record.get(key) for record in records]
+                             for key in present_keys if key not in described},
+                            index=pd.RangeIndex(len(records)))
+        return self.build_table(operation_id, schema_columns,
+                                partial(record_values, records, present_keys=present_keys), rest)
+
+    def build_table(self, operation_id, schema_columns, schema_values, rest, dense=None, sparse=None):
+        inferred = self.construct_domain(rest)
+        indicator_columns = [name for indicators in (dense, sparse) if indicators is not None
+                             for name in indicators.columns]
+        domain = self.combined_domain(operation_id, schema_columns, inferred, indicator_columns)
+
+        schema_attributes = [column for column in schema_columns if column.variable.is_primitive()]
+        schema_metas = [column for column in schema_columns if not column.variable.is_primitive()]
+        num_dense = len(dense.columns) if dense is not None else 0
+        X = np.empty((len(rest), len(schema_attributes) + len(inferred.attributes) + num_dense))
+        for j, column in enumerate(schema_attributes):
+            X[:, j] = schema_values(column)
+        X[:, len(schema_attributes):X.shape[1] - num_dense] = self.attribute_values(rest, inferred)
+        if dense is not None:
+            # 0 and 1 are also the indices of the values of the indicator variables
+            X[:, X.shape[1] - num_dense:] = dense.to_numpy(dtype=float)
+        if sparse is not None:
+            X = sp.hstack([sp.csr_matrix(X), sparse.sparse.to_coo().astype(float)], format="csr")
+
+        metas = np.empty((len(rest), len(schema_metas) + len(inferred.metas)), dtype=object)
+        for k, column in enumerate(schema_metas):
+            metas[:, k] = schema_values(column)
+        for k, variable in enumerate(inferred.metas, len(schema_metas)):
+            metas[:, k] = rest[variable.name].to_numpy(dtype=object)
+        return Orange.data.Table.from_numpy(domain=domain, X=X, Y=None, metas=metas, W=None)
+
+    @staticmethod
+    def discrete_codes(column, variable):
+        # Discrete columns hold the index of the value, values missing from the domain become nan
+        codes = pd.Index([int(value) for value in variable.values]).get_indexer(column).astype(float)
+        codes[codes < 0] = np.nan
+        return codes
+
+    def attribute_values(self, df, domain):
+        X = np.empty((len(df), len(domain.attributes)), dtype=float)
+        for i, variable in enumerate(domain.attributes):
+            column = df[variable.name].to_numpy()
+            X[:, i] = self.discrete_codes(column, variable) if variable.is_discrete else column
+        return X
+
+    def domain_fits(self, df, domain):
+        return all(
+            not np.isnan(self.discrete_codes(df[variable.name].to_numpy(), variable)).any()
+            for variable in domain.attributes if variable.is_discrete)
 
     def construct_domain(self, df):
-        columns = OrderedDict(df.dtypes)
-        attributes = OrderedDict()
-        metas = OrderedDict()
-        for name, dtype in columns.items():
-            if issubclass(dtype.type, np.number):
-                if len(df[name].unique()) >= 13 or issubclass(dtype.type, np.inexact) or (
-                        df[name].max() > len(df[name].unique())):
-                    attributes[name] = Orange.data.ContinuousVariable(name)
-                else:
-                    df[name] = df[name].astype(str)
-                    attributes[name] = Orange.data.DiscreteVariable(name,
-                                            values=sorted(df[name].unique().tolist()))
+        # Pages and refreshes of the same route have the same columns, and reusing
+        # the domain keeps downstream widgets from resetting their selections
+        key = tuple((name, str(dtype)) for name, dtype in df.dtypes.items())
+        domain = self.domain_cache.get(key)
+        if domain is not None and self.domain_fits(df, domain):
+            self.domain_cache.move_to_end(key)
+            return domain
+
+        domain = self.infer_domain(df)
+        self.domain_cache[key] = domain
+        if len(self.domain_cache) > DOMAIN_CACHE_SIZE:
+            self.domain_cache.popitem(last=False)
+        return domain
+
+    def infer_domain(self, df):
+        # Integer columns with few small values are discrete, the statistics for
+        # all of them come from a single sort of the integer block
+        integer_columns = [name for name, dtype in df.dtypes.items() if issubclass(dtype.type, np.integer)]
+        categories = {}
+        if integer_columns and len(df):
+            values = np.sort(df[integer_columns].to_numpy(dtype=np.int64), axis=0)
+            first_occurrences = np.vstack([np.ones((1, len(integer_columns)), dtype=bool),
+                                           values[1:] != values[:-1]])
+            num_unique = first_occurrences.sum(axis=0)
+            maxima = values[-1]
+            for j, name in enumerate(integer_columns):
+                if num_unique[j] < 13 and maxima[j] <= num_unique[j]:
+                    categories[name] = values[first_occurrences[:, j], j]
+
+        attributes = []
+        metas = []
+        for name, dtype in df.dtypes.items():
+            if name in categories:
+                attributes.append(Orange.data.DiscreteVariable(
+                    name, values=[str(value) for value in categories[name]]))
+            elif issubclass(dtype.type, np.number):
+                attributes.append(Orange.data.ContinuousVariable(name))
             else:
-                metas[name] = Orange.data.StringVariable(name)
-
-        domain = Orange.data.Domain(attributes=attributes.values(), metas=metas.values())
-        return domain, list(attributes.keys()), list(metas.keys())
-
-    def binarize_columns(self, df, remove_original_columns=False):
-        mlb = MultiLabelBinarizer()
-        # all_lists = lambda column: (column.sample(int(len(column) * 0.1)).apply(type).astype(str) == "<class 'list'>").all(0)
-        any_lists = lambda column: (column.sample(int(len(column) * 0.1)).apply(type).astype(str) == "<class 'list'>").any(0)
+                metas.append(Orange.data.StringVariable(name))
+        return Orange.data.Domain(attributes=attributes, metas=metas)
+
+    @staticmethod
+    def is_dict_column(column):
+        if column.dtype != object:
+            return False
+        first_valid = column.first_valid_index()
+        return first_valid is not None and isinstance(column.at[first_valid], dict)
+
+    @staticmethod
+    def nested_key_paths(values, depth):
+        # Key paths of objects the schema does not describe are read from the data
+        paths = []
+        for key in dict.fromkeys(key for value in values if isinstance(value, dict) for key in value):
+            nested = nested_values(values, (key,))
+            if depth > 1 and any(isinstance(value, dict) for value in nested):
+                paths.extend((key,) + path for path in WidgetsHelper.nested_key_paths(nested, depth - 1))
+            else:
+                paths.append((key,))
+        return paths
+
+    def expand_nested_columns(self, df, depth=1, schema_columns=(), remove_original_columns=False):
+        """
+        Expand columns holding objects into dotted columns (price -> price.amount, ...), up to
+        `depth` levels deep. The key paths come from the response schema when there is one.
+        """
+        if depth <= 0:
+            return df
+        schema_paths = {}
+        for column in schema_columns:
+            if len(column.path) > 1:
+                schema_paths.setdefault(column.path[0], []).append(column.path[1:])
+
+        expanded, expanded_columns = {}, []
+        for name in df.columns:
+            if not self.is_dict_column(df[name]):
+                continue
+            values = df[name].to_numpy(dtype=object)
+            for path in schema_paths.get(name) or self.nested_key_paths(values, depth):
+                expanded[".".join((name,) + path)] = nested_values(values, path)
+            expanded_columns.append(name)
+        if not expanded:
+            return df
+        if remove_original_columns:
+            df = df.drop(columns=expanded_columns)
+        return pd.concat([df, pd.DataFrame(expanded, index=df.index)], axis=1)
+
+    def flatten_frame(self, df, options, warnings):
+        """Expand nested objects and binarize list columns, as set in the transform options"""
+        df = self.expand_nested_columns(
+            df, options.nested_depth, self.schema_columns(options.operation_id, options.nested_depth),
+            options.remove_original_columns)
+        return self.binarize_columns(
+            df, options.remove_original_columns, warnings=warnings, sparse_threshold=options.sparse_threshold)
+
+    @staticmethod
+    def is_list_column(column):
+        # Only object columns can hold lists, and the api never mixes lists with other values
+        if column.dtype != object:
+            return False
+        first_valid = column.first_valid_index()
+        return first_valid is not None and isinstance(column.at[first_valid], (list, tuple))
+
+    @staticmethod
+    def indicator_columns(column, sparse_threshold=0.0):
+        """
+        One 0/1 column per distinct element of the lists in `column`, named column_element.
+        The columns are sparse when at most `sparse_threshold` of the cells are ones.
+        """
+        positions = pd.Series(column.values, index=np.arange(len(column))).explode()
+        positions = positions[positions.notna()]
+        try:
+            codes, labels = pd.factorize(positions, sort=True)
+        except TypeError:
+            # Unorderable mixes of element types, keep them in order of appearance
+            codes, labels = pd.factorize(positions, sort=False)
+        rows = positions.index.to_numpy()
+        names = [column.name + "_" + str(x) for x in labels]
+        shape = (len(column), len(labels))
+
+        if len(rows) <= sparse_threshold * shape[0] * shape[1]:
+            indicators = sp.csr_matrix((np.ones(len(rows), dtype=INDICATOR_DTYPE), (rows, codes)), shape=shape)
+            # Repeated elements within a list are summed by the constructor
+            indicators.sum_duplicates()
+            indicators.data.fill(1)
+            return pd.DataFrame.sparse.from_spmatrix(indicators, index=column.index, columns=names)
+
+        indicators = np.zeros(shape, dtype=INDICATOR_DTYPE)
+        indicators[rows, codes] = 1
+        return pd.DataFrame(indicators, index=column.index, columns=names)
+
+    def binarize_columns(self, df, remove_original_columns=False, warnings=None, sparse_threshold=0.0):
+        flattened, flattened_columns = [], []
         for column in df.columns:
-            if any_lists(df[column]):
-                try:
-                    transformed_column = mlb.fit_transform(df[column])
-                    transformed_column = pd.DataFrame(transformed_column,
-                                                      columns=[column + "_" + str(x) for x in mlb.classes_])
-                    df = pd.concat([df, transformed_column], axis=1)
-                    if remove_original_columns:
-                        df = df.drop(column, axis=1)
-                except Exception as e:
-                    warning_message = f"Could not flatten column (binarize_columns): {column} "
-                    QMessageBox.warning(self, "Warning", warning_message + str(e), QMessageBox.Ok)
-                    self.warning(warning_message + str(e))
-        return df
+            if not self.is_list_column(df[column]):
+                continue
+            try:
+                flattened.append(self.indicator_columns(df[column], sparse_threshold))
+                flattened_columns.append(column)
+            except Exception as e:
+                warning_message = f"Could not flatten column (binarize_columns): {column} "
+                # Off the ui thread the caller shows the collected warnings itself
+                if warnings is not None:
+                    warnings.append(warning_message + str(e))
+                    continue
+                QMessageBox.warning(self, "Warning", warning_message + str(e), QMessageBox.Ok)
+                self.warning(warning_message + str(e))
+        if not flattened:
+            return df
+        if remove_original_columns:
+            df = df.drop(columns=flattened_columns)
+        # A single concat, growing the frame once per column copies it every time
+        return pd.concat([df] + flattened, axis=1)
 
     def clear_element(self, element):
         layout = element.layout()
@@ -108,20 +312,8 @@ class WidgetsHelper:
                 widget.close()
 
     def get_parameters(self):
-        parameters = {}
-        # loop through paths
-        for path in self.api_reference_json["paths"]:
-            # loop through all items
-            for item in self.api_reference_json["paths"][path]:
-                # loop through all sub items
-                for sub_item_name in self.api_reference_json["paths"][path][item]:
-                    # get object
-                    obj = self.api_reference_json["paths"][path][item][sub_item_name]
-                    # check if sub_item_name is "parameters"
-                    if sub_item_name == "parameters":
-                        for parameter in obj:
-                            parameters[parameter["name"]] = parameter
-        return parameters
+        # Indexed once per process by the api reference loader
+        return self.api_reference.parameters
 
     def build_pyqt_element_from_parameter(self, parameter_name, callback):
         parameter = self.parameters.get(parameter_name)
@@ -131,10 +323,14 @@ class WidgetsHelper:
         schema = parameter["schema"]
         element = None
 
-        if parameter_name == "taxonomy_id" and not self.TAXONOMY_ID_RAW:
+        # Until the taxonomy has been fetched once the id has to be typed in
+        taxonomy = self.taxonomy_store.taxonomy
+        taxonomy_id_raw = self.TAXONOMY_ID_RAW or taxonomy is None
+
+        if parameter_name == "taxonomy_id" and not taxonomy_id_raw:
             # if not hasattr(self, "taxonomy_button"):
             element = TaxonomyMenuButton(
-                title="Taxonomy", results=self.ETSY_taxonomy_items["results"])
+                title="Taxonomy", results=taxonomy["results"])
             element.objectNameChanged.connect(lambda text : callback(
                 data=self.sender().taxonomy_id, widget=element, widget_name="taxonomy_id"))
 
@@ -154,7 +350,7 @@ class WidgetsHelper:
         #         and not parameter["name"] in ["shop_id", "taxonomy_id"]:
         elif schema["type"] == "integer" \
                 and not (parameter["name"] in ["shop_id", "taxonomy_id"]) \
-                or (parameter["name"] == "taxonomy_id" and self.TAXONOMY_ID_RAW):
+                or (parameter["name"] == "taxonomy_id" and taxonomy_id_raw):
             # Code block to execute when the condition is True
 
             # Code block to execute when the condition is True
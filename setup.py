@@ -31,6 +31,7 @@ INSTALL_REQUIRES = [
     "requests",
     "superqt",
     "qasync",
+    "aiohttp",
     "etsyv3",
     "numpy",
 ]